@@ -3,136 +3,234 @@ Agent configuration and runner system for Triple Whale.
 """
 import os
 import asyncio
+import functools
+import importlib
+from collections import ChainMap
 import sys
 import traceback
 from utils import log
 
-# Import tools - but handle potential import errors gracefully
+# Tool modules are imported lazily (see module-level __getattr__ below) so that
+# process startup and uvicorn reload only pay for the tools a request actually
+# touches. Each entry maps an exported tool name to its module under tools/.
+_TOOL_NAMES = [
+    'text_to_sql',
+    'text_to_python',
+    'searching',
+    'forecasting',
+    'marketing_mix_model',
+    'preload_dashboard_data',
+    'vision',
+    # Fallback tools
+    'answer_nlq_question',
+    'search_web',
+    # Composite: analytics + web search in one concurrent call
+    'parallel_lookup',
+]
+
+# The agent prompt lives in prompts/moby.md so it is edited as prose and only
+# read from disk once, inside the cached agent builder
+_PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+def _load_instructions(name: str) -> str:
+    """Read an agent prompt from the prompts/ directory."""
+    with open(os.path.join(_PROMPTS_DIR, f"{name}.md"), 'r', encoding='utf-8') as f:
+        return f.read()
+
+# Get model from environment or use default
+model = os.getenv('MODEL_CHOICE', 'gpt-4o-mini')
+
+# Import the agents SDK - but handle potential import errors gracefully
 try:
     from agents import Runner, Agent
-    
-    # Import our specialized tools
-    from tools.text_to_sql import text_to_sql
-    from tools.text_to_python import text_to_python
-    from tools.searching import searching
-    from tools.forecasting import forecasting
-    from tools.marketing_mix_model import marketing_mix_model
-    from tools.preload_dashboard_data import preload_dashboard_data
-    from tools.vision import vision
-    # Import fallback tools
-    from tools.answer_nlq_question import answer_nlq_question
-    from tools.search_web import search_web
-    
-    # Get model from environment or use default
-    model = os.getenv('MODEL_CHOICE', 'gpt-4o-mini')
-    
-    # Create Moby - an ecommerce assistant agent with the approved tools
-    moby_agent = Agent(
-        name="Moby",
-        instructions="""
-        You are Moby 🐳, an assistant for e-commerce and marketing strategies on Triple Whale. Your users are marketing professionals and e-commerce managers. 
-        Your mission is to assist without revealing your AI origins or internal reasoning. 
-        You will use Consultative/Expert Mode, Professional and Encouraging, and Concise and Insight-numbers Driven in your responses to align with the user's communication preferences. 
-        You never generate generic response.
-        
-        You can provide personalized product recommendations, help users find the best deals, 
-        track orders, answer questions about products, and assist with various shopping-related tasks.
-        
-        You have access to these specific custom tools:
-        1. text_to_sql: For getting data from the user's database by converting natural language to SQL.
-        2. text_to_python: For converting natural language to Python code and executing it to analyze data.
-        3. searching: For providing information about the Triple Whale platform, e-commerce, and marketing.
-        4. forecasting: For forecasting time series metrics into the future based on historical data.
-        5. marketing_mix_model: For analyzing ad budget allocation and predicting impact on business outcomes.
-        6. preload_dashboard_data: For retrieving and analyzing data from existing Triple Whale dashboards.
-        7. vision: For analyzing and describing uploaded images or videos to extract insights.
-        
-        Fallback tools (use only if the specialized tools fail):
-        8. answer_nlq_question: General-purpose fallback for any e-commerce analytics question when specialized tools fail.
-        9. search_web: For searching the web for information not available through other tools.
-        
-        Choose the most appropriate specialized tool based on the user's question:
-        - Use 'text_to_sql' when the user needs specific data or metrics from their database.
-        - Use 'text_to_python' when complex analysis or data transformations are needed.
-        - Use 'searching' for questions about Triple Whale features, e-commerce concepts, or marketing strategies.
-        - Use 'forecasting' when the user wants to predict future trends or metrics.
-        - Use 'marketing_mix_model' for questions about ad budget allocation, channel performance, or ROAS optimization.
-        - Use 'preload_dashboard_data' when referring to existing dashboard data or for quick insights.
-        - Use 'vision' when the user has uploaded images or videos that need analysis.
-        
-        If a specialized tool fails to provide a satisfactory response or returns an error, try using the answer_nlq_question fallback tool.
-        The answer_nlq_question tool can handle a wide range of e-commerce questions and should be used as a backup option.
-        
-        If you need to find general information not available in Triple Whale, use the search_web tool as a last resort.
-        
-        Always prefer using tools rather than generating answers from your general knowledge. For most questions, you should use at least one tool to provide accurate, up-to-date information.
-        
-        Always be helpful, informative, and enthusiastic about helping users optimize their e-commerce business.
-        Focus on providing accurate information and actionable insights based on data.
-        
-        When making recommendations, consider the user's business context, industry trends, and data-driven insights.
-        Always prioritize clear explanations of metrics and insights that drive business value.
-        """,
-        model=model,
-        tools=[
-            text_to_sql,
-            text_to_python,
-            searching,
-            forecasting,
-            marketing_mix_model,
-            preload_dashboard_data,
-            vision,
-            # Fallback tools
-            answer_nlq_question,
-            search_web
-        ]
-    )
-    
-    # Create a Runner class that just passes context to tools
-    class CustomRunner:
-        @classmethod
-        async def run(cls, agent, input, context=None, sid=None, socket=None):
-            # Make a copy of the original context or create a new one
-            run_context = dict(context or {})
-            
-            # Add socket and sid to context if provided
-            if socket and sid:
-                run_context['socket'] = socket
-                run_context['sid'] = sid
-                
-                # Add a flag that tools can check to see if we're monitoring tools
-                run_context['monitor_tools'] = True
-            
-            log(f"Starting run with agent: {agent.name}", "DEBUG")
-            
-            try:
-                # Call the original Runner's run method, not recursively
-                result = await Runner.run(agent, input, context=run_context)
-                log(f"Agent run completed", "DEBUG")
-                return result
-            except Exception as e:
-                log(f"Error in CustomRunner.run: {str(e)}", "ERROR")
-                raise
-        
+    # ModelSettings is optional: older SDK versions ship without it (or
+    # without prompt_cache_key), and the agent works fine either way
+    try:
+        from agents import ModelSettings
+    except ImportError:
+        ModelSettings = None
+    _AGENTS_AVAILABLE = True
 except ImportError as e:
     log(f"ERROR: Unable to import required modules: {str(e)}", "ERROR")
     log(f"Traceback: {traceback.format_exc()}", "ERROR")
-    
+
     # Define fallback mocks for Runner and Agent to prevent immediate crashes
     class MockAgent:
         def __init__(self, **kwargs):
             self.name = kwargs.get('name', 'Mock Agent')
             log(f"MOCK AGENT CREATED: {self.name}", "WARNING")
-    
+
     class MockRunner:
         @classmethod
         async def run(cls, agent, input, context=None, sid=None, socket=None):
             log("MOCK RUNNER: Unable to run real agent due to import error", "WARNING")
             return type('obj', (object,), {'final_output': 'Error: Agent system is not available.'})
-    
+
+        @classmethod
+        def run_streamed(cls, agent, input, context=None, sid=None, socket=None):
+            log("MOCK RUNNER: Unable to stream real agent due to import error", "WARNING")
+
+            async def _no_events():
+                return
+                yield  # pragma: no cover - makes this an async generator
+
+            return type('obj', (object,), {
+                'final_output': 'Error: Agent system is not available.',
+                'stream_events': staticmethod(_no_events)
+            })
+
     # Create mock versions
-    Agent = MockAgent  
+    Agent = MockAgent
     Runner = MockRunner
-    moby_agent = MockAgent(name="Moby (Mock)")
-    
-    log("WARNING: Using mock implementations due to import failure!", "WARNING") 
\ No newline at end of file
+    ModelSettings = None
+    _AGENTS_AVAILABLE = False
+
+    log("WARNING: Using mock implementations due to import failure!", "WARNING")
+
+
+def _resolve_tool(name: str):
+    """Import a tool module on first use and cache the tool in module globals."""
+    tool = getattr(importlib.import_module(f"tools.{name}"), name)
+    globals()[name] = tool
+    return tool
+
+
+@functools.cache
+def _build_moby_agent():
+    """Construct Moby - an ecommerce assistant agent with the approved tools.
+
+    Cached so accidental re-imports or reloads reuse the same tool-wired
+    instance instead of rebuilding it.
+    """
+    if not _AGENTS_AVAILABLE:
+        return Agent(name="Moby (Mock)")
+
+    try:
+        tools = [_resolve_tool(name) for name in _TOOL_NAMES]
+    except ImportError as e:
+        log(f"ERROR: Unable to import tool modules: {str(e)}", "ERROR")
+        log(f"Traceback: {traceback.format_exc()}", "ERROR")
+        log("WARNING: Using mock agent due to tool import failure!", "WARNING")
+        return type('MockAgent', (object,), {'name': 'Moby (Mock)'})()
+
+    # Route the SDK's model traffic through the tools' shared pooled client
+    # so LLM calls and tool calls reuse one keep-alive connection pool (and
+    # one shutdown hook). Skipped quietly on SDK/openai versions without the
+    # hook or when the client can't be built (e.g. no API key).
+    try:
+        import httpx
+        from agents import set_default_openai_client
+        from openai import AsyncOpenAI
+        from tools.utils import get_http_client
+        # A custom http_client makes the OpenAI SDK inherit its timeout, and
+        # the tool client's 30s read limit is far too tight for non-streamed
+        # completions (batch runs can legitimately take minutes). Restore the
+        # SDK's 600s default explicitly while keeping the shared pool.
+        set_default_openai_client(AsyncOpenAI(
+            http_client=get_http_client(),
+            timeout=httpx.Timeout(600.0, connect=5.0)
+        ))
+    except ImportError:
+        pass
+    except Exception as client_err:
+        log(f"Could not configure shared OpenAI client: {client_err}", "WARNING")
+
+    agent_kwargs = dict(
+        name="Moby",
+        instructions=_load_instructions('moby'),
+        model=model,
+        tools=tools
+    )
+
+    # The instructions are byte-identical across turns (read once from
+    # prompts/moby.md), so a stable prompt cache key lets the provider reuse
+    # its KV cache for the system prompt instead of re-processing it per turn
+    if ModelSettings is not None:
+        try:
+            agent_kwargs['model_settings'] = ModelSettings(prompt_cache_key="moby-v1")
+        except TypeError:
+            # SDK predates prompt_cache_key; run without it
+            pass
+
+    return Agent(**agent_kwargs)
+
+
+# Create a Runner class that just passes context to tools
+class CustomRunner:
+    @classmethod
+    async def run(cls, agent, input, context=None, sid=None, socket=None):
+        # Layer a small per-run overlay over the caller's context instead of
+        # cloning the whole dict; tool writes land in the overlay
+        overlay = {}
+
+        # Add socket and sid to the overlay if provided
+        if socket and sid:
+            overlay['socket'] = socket
+            overlay['sid'] = sid
+
+            # Add a flag that tools can check to see if we're monitoring tools
+            overlay['monitor_tools'] = True
+
+        run_context = ChainMap(overlay, context or {})
+
+        log(f"Starting run with agent: {agent.name}", "DEBUG")
+
+        try:
+            # Call the original Runner's run method, not recursively
+            result = await Runner.run(agent, input, context=run_context)
+            log(f"Agent run completed", "DEBUG")
+            return result
+        except Exception as e:
+            log(f"Error in CustomRunner.run: {str(e)}", "ERROR")
+            raise
+
+    @classmethod
+    def run_streamed(cls, agent, input, context=None, sid=None, socket=None):
+        # Layer a small per-run overlay over the caller's context instead of
+        # cloning the whole dict; tool writes land in the overlay
+        overlay = {}
+
+        # Add socket and sid to the overlay if provided
+        if socket and sid:
+            overlay['socket'] = socket
+            overlay['sid'] = sid
+
+            # Add a flag that tools can check to see if we're monitoring tools
+            overlay['monitor_tools'] = True
+
+        run_context = ChainMap(overlay, context or {})
+
+        log(f"Starting streamed run with agent: {agent.name}", "DEBUG")
+
+        # Return the streaming result so callers can iterate events as they arrive
+        return Runner.run_streamed(agent, input, context=run_context)
+
+    @classmethod
+    async def run_batch(cls, agent, inputs, contexts=None, max_concurrency=8):
+        # Run several prompts concurrently, bounded so we don't overwhelm the provider
+        if contexts is None:
+            contexts = [None] * len(inputs)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(single_input, single_context):
+            async with semaphore:
+                return await cls.run(agent, single_input, context=single_context)
+
+        log(f"Starting batch run of {len(inputs)} inputs with agent: {agent.name}", "DEBUG")
+
+        return await asyncio.gather(*[
+            run_one(single_input, single_context)
+            for single_input, single_context in zip(inputs, contexts)
+        ])
+
+
+def __getattr__(name):
+    """Lazily resolve tools and the agent itself on first attribute access."""
+    if name in _TOOL_NAMES:
+        return _resolve_tool(name)
+    if name == 'moby_agent':
+        agent = _build_moby_agent()
+        globals()['moby_agent'] = agent
+        return agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,7 @@
 """
 Main entry point for the Triple Whale agent system.
 """
+import mimetypes
 import os
 import sys
 import socketio
@@ -8,7 +9,15 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
+
+# Serialize all plain-dict endpoint responses (health, history, errors)
+# through orjson when available; fall back to the default JSONResponse.
+try:
+    from fastapi.responses import ORJSONResponse as _DefaultResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as _DefaultResponse
+from starlette.datastructures import Headers
 from starlette.exceptions import HTTPException
 
 # Add the current directory to the Python path to ensure imports work
@@ -29,7 +38,7 @@ else:
     log("WARNING: No OpenAI API key found in environment!")
 
 # Create a FastAPI app
-app = FastAPI(title="Moby Ecommerce Assistant API")
+app = FastAPI(title="Moby Ecommerce Assistant API", default_response_class=_DefaultResponse)
 
 # Add CORS middleware to the FastAPI app
 app.add_middleware(
@@ -43,6 +52,49 @@ app.add_middleware(
 # Add routes to the FastAPI app
 app.include_router(http_router)
 
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    """Drain the tools' shared HTTP connection pool on server shutdown."""
+    from tools.utils import aclose_http_client
+    await aclose_http_client()
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with immutable caching and precompressed variant support.
+
+    The SPA build emits content-hashed asset names, so returning visitors can
+    cache them for a year without revalidation. If the build also produced
+    .br/.gz siblings (e.g. via `vite-plugin-compression`), serve those when
+    the client accepts the encoding.
+    """
+
+    CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+    async def get_response(self, path: str, scope):
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+
+        # Prefer a precompressed sibling when the client supports it
+        for suffix, encoding in ((".br", "br"), (".gz", "gzip")):
+            if encoding not in accept_encoding:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            if response.status_code == 200:
+                response.headers["content-encoding"] = encoding
+                response.headers["vary"] = "Accept-Encoding"
+                # Report the content type of the uncompressed asset
+                content_type, _ = mimetypes.guess_type(path)
+                if content_type:
+                    response.headers["content-type"] = content_type
+                response.headers["cache-control"] = self.CACHE_CONTROL
+                return response
+
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["cache-control"] = self.CACHE_CONTROL
+        return response
+
 # Check if we're in production mode and should serve the frontend
 is_production = os.getenv('NODE_ENV') == 'production'
 frontend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'dist')
@@ -52,28 +104,61 @@ if is_production and os.path.exists(frontend_dir):
     log(f"Client can be accessed at http://localhost:{os.getenv('PORT', '9876')}", "GLOBAL")
     
     # Mount static files (JS, CSS, images)
-    app.mount("/assets", StaticFiles(directory=os.path.join(frontend_dir, "assets")), name="assets")
+    app.mount("/assets", CachedStaticFiles(directory=os.path.join(frontend_dir, "assets")), name="assets")
     
-    # Define a catch-all route for frontend SPA
+    # Read the SPA shell once at startup; FileResponse would re-stat and
+    # re-open index.html on every request
+    index_path = os.path.join(frontend_dir, "index.html")
+    index_bytes = None
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as index_file:
+            index_bytes = index_file.read()
+
+    # Define a catch-all route for frontend SPA. API routes are registered
+    # first, so Starlette's router resolves them before this falls through.
     @app.get("/{full_path:path}", include_in_schema=False)
     async def serve_frontend(full_path: str):
-        # If the path starts with 'api/', let it be handled by the API routes
-        if full_path.startswith("api/"):
-            raise HTTPException(status_code=404, detail="API route not found")
-        
-        # For all other paths, serve the index.html (SPA behavior)
-        index_path = os.path.join(frontend_dir, "index.html")
-        if os.path.exists(index_path):
-            return FileResponse(index_path)
-        else:
+        # For all unmatched paths, serve the cached index.html (SPA behavior)
+        if index_bytes is None:
             raise HTTPException(status_code=404, detail="Frontend not built")
+        return Response(index_bytes, media_type="text/html")
 else:
     log("Development mode or frontend not built. Not serving static files.")
 
-# Create Socket.IO server with explicit CORS configuration
+# Socket.IO serializes every emit; hand it orjson through a stdlib-shaped
+# shim when available
+try:
+    import orjson
+
+    class _OrjsonPackaging:
+        """Adapter exposing stdlib-json signatures over orjson for Socket.IO."""
+
+        @staticmethod
+        def dumps(obj, *args, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        @staticmethod
+        def loads(data, *args, **kwargs):
+            return orjson.loads(data)
+
+    _sio_json = _OrjsonPackaging
+except ImportError:
+    import json as _sio_json
+
+# Create Socket.IO server with explicit CORS configuration.
+# Small frames (pong, stream_update) dominate this server's traffic; Nagle
+# would batch them behind up to ~40ms of delay, but uvicorn sets TCP_NODELAY
+# on every accepted connection (as do uvloop's transports), so emits hit the
+# wire immediately. The ping settings keep idle websockets alive through
+# proxies without the client-side disconnect churn of the 20s default timeout.
 sio = socketio.AsyncServer(
-    async_mode='asgi', 
+    async_mode='asgi',
     cors_allowed_origins='*',
+    json=_sio_json,  # C-speed payload serialization
+    ping_interval=25,  # Engine.IO heartbeat; under typical proxy idle-close thresholds
+    ping_timeout=20,
+    async_handlers=True,  # Handle events concurrently across clients
+    max_http_buffer_size=1 << 20,  # Cap inbound message size (1 MiB) so one client can't balloon memory
     logger=False,  # Disable logging
     engineio_logger=False  # Disable Engine.IO logging
 )
@@ -90,7 +175,26 @@ application = socket_app
 # Run the API if this script is executed directly
 if __name__ == "__main__":
     import uvicorn
-    
+
+    # Install uvloop as the event loop policy before anything creates a loop.
+    # Its C (libuv) implementation of call_soon/socket readiness typically
+    # 2-4x's small-message throughput, which dominates the ping/stream_update
+    # hot path. Fall back to the stdlib loop when it isn't installed.
+    try:
+        import uvloop
+        uvloop.install()
+        loop_impl = "uvloop"
+    except ImportError:
+        loop_impl = "auto"
+
+    # Same graceful degradation for the C HTTP parser
+    try:
+        import httptools  # noqa: F401
+        http_impl = "httptools"
+    except ImportError:
+        http_impl = "auto"
+
+
     # Get the port from environment variable or default to 9876
     port = int(os.getenv("PORT", 9876))
     log(f"Starting server on port {port}", "GLOBAL")
@@ -99,13 +203,23 @@ if __name__ == "__main__":
     log(f"Python version: {sys.version}")
     log(f"Python path: {sys.path}")
     
-    # Run the application with uvicorn
+    # Run the application with uvicorn.
+    # In production: the C-accelerated event loop and HTTP parser, no reload
+    # supervisor. In development: single worker with auto-reload for fast
+    # iteration. Workers default to 1 because sessions and Socket.IO state
+    # are in-process: multiple workers would each hold a private copy of
+    # user_contexts/chat_histories and drop polling upgrades that land on a
+    # different worker. Scale out only once a socketio.AsyncRedisManager and
+    # a shared store are wired in, via WEB_CONCURRENCY.
     uvicorn.run(
-        "app:application", 
-        host="0.0.0.0", 
-        port=port, 
-        reload=True, 
+        "app:application",
+        host="0.0.0.0",
+        port=port,
+        reload=not is_production,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")) if is_production else 1,
+        loop=loop_impl,     # C-accelerated event loop when available
+        http=http_impl,     # C-accelerated HTTP parser when available
         log_level="error",  # Only show error logs
         access_log=False,   # Disable access logs
-        reload_dirs=["backend"]  # Only watch this directory for changes
-    ) 
\ No newline at end of file
+        reload_dirs=["backend"] if not is_production else None  # Only watch this directory for changes
+    )
\ No newline at end of file
@@ -1,133 +1,344 @@
 """
 HTTP routes for the Triple Whale agent API.
 """
-import uuid
 import json
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+from collections import ChainMap
+from typing import List, Optional
+import anyio
+from fastapi import APIRouter, Request
+from fastapi.responses import Response, StreamingResponse
 import asyncio
-from datetime import datetime
 
-from models import ChatRequest, ChatResponse
-from agent import CustomRunner, moby_agent
-from utils import format_agent_response, log, get_timestamp
+try:
+    import orjson
+
+    def _json_dumps(payload) -> bytes:
+        return orjson.dumps(payload)
+except ImportError:
+    def _json_dumps(payload) -> bytes:
+        return json.dumps(payload).encode('utf-8')
+
+from models import (
+    ChatRequest,
+    ChatResponse,
+    decode_chat_request,
+    decode_chat_request_list,
+    encode_json,
+)
+# The agent itself is resolved lazily on first use (module __getattr__ in
+# agent.py builds it then); importing only CustomRunner keeps startup cheap
+import agent
+from agent import CustomRunner
+from utils import format_agent_response, log, get_timestamp, get_iso_timestamp
 import state
 
 # Create a router
 router = APIRouter()
 
+# Constant SSE framing, pre-encoded once
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+def sse_frame(payload: dict) -> bytes:
+    """Serialize a payload dict into a single SSE data frame as bytes."""
+    return _SSE_PREFIX + _json_dumps(payload) + _SSE_SUFFIX
+
+# Sentinel marking the end of an agent run on the shared event queue
+_STREAM_DONE = object()
+
+# First-turn greetings don't need history building or a tool-capable agent
+# run; answer them from a canned response encoded once at import
+_TRIVIAL_PROMPTS = {"hi", "hello", "hey", "yo", "help"}
+_GREETING = (
+    "Hi, I'm Moby \U0001F433! Ask me about your store's sales, ad performance, "
+    "forecasts, or anything e-commerce and I'll dig into the data for you."
+)
+_GREETING_FRAME = sse_frame({"type": "content", "content": _GREETING})
+
+# The initial loading frame never varies; encode it once at import
+_PROCESSING_FRAME = sse_frame({"type": "loading", "content": "Processing your request..."})
+
+def _is_trivial(message: str) -> bool:
+    """Match short greeting-style prompts that deserve the canned fast path."""
+    return message.strip().lower().rstrip("!?.") in _TRIVIAL_PROMPTS
+
+async def buffered_sse_stream(source, max_buffer_size=64, max_batch_bytes=8192, flush_interval=0.01):
+    """Drain an SSE generator through a memory channel, coalescing small frames.
+
+    A producer task pushes frames into an anyio memory object stream while the
+    consumer batches whatever arrives within flush_interval (up to
+    max_batch_bytes) into a single write. Many tiny token frames then cost one
+    event-loop hop per batch instead of one per frame; since every frame ends
+    with a blank line, concatenated frames are still valid SSE.
+    """
+    send_stream, receive_stream = anyio.create_memory_object_stream(max_buffer_size=max_buffer_size)
+
+    async def produce():
+        try:
+            async for chunk in source:
+                await send_stream.send(chunk)
+        finally:
+            await send_stream.aclose()
+
+    producer = asyncio.create_task(produce())
+    try:
+        closed = False
+        while not closed:
+            # Block for the first frame of the next batch
+            try:
+                buffer = bytearray(await receive_stream.receive())
+            except anyio.EndOfStream:
+                break
+
+            # Fold in whatever else arrives within the flush window
+            with anyio.move_on_after(flush_interval):
+                while len(buffer) < max_batch_bytes:
+                    try:
+                        buffer += await receive_stream.receive()
+                    except anyio.EndOfStream:
+                        closed = True
+                        break
+
+            yield bytes(buffer)
+
+        # Surface any exception raised by the source generator
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+
 # Streaming response function for HTTP API
 async def stream_agent_response(user_id: str, message: str):
-    context = state.get_or_create_user_context(user_id)
-    
-    # Add user message to chat history
     timestamp = get_timestamp()
-    state.add_message_to_history(user_id, "user", message, timestamp)
-    
+
+    # Fast path: trivial first-turn prompts skip the agent entirely
+    if not state.has_history(user_id) and _is_trivial(message):
+        await state.add_message_to_history(user_id, "user", message, timestamp)
+        yield _GREETING_FRAME
+        await state.add_message_to_history(user_id, "assistant", _GREETING, get_timestamp())
+        return
+
+    # Serve repeated prompts straight from the response cache when enabled,
+    # skipping the whole LLM + tool round trip
+    cache_key = state.response_cache_key(user_id, message) if state.RESPONSE_CACHE_ENABLED else None
+    if cache_key is not None:
+        cached_response = state.get_cached_response(cache_key)
+        if cached_response is not None:
+            await state.add_message_to_history(user_id, "user", message, timestamp)
+            yield sse_frame({"type": "content", "content": cached_response})
+            await state.add_message_to_history(user_id, "assistant", cached_response, get_timestamp())
+            return
+
+    # Fetch the context and record the user message concurrently - they are
+    # independent, so we pay for the slower of the two rather than the sum
+    context, _ = await asyncio.gather(
+        state.get_or_create_user_context(user_id),
+        state.add_message_to_history(user_id, "user", message, timestamp)
+    )
+
     # Prepare input for the agent using chat history
-    input_list = state.format_history_for_agent(user_id)
+    input_list = await state.format_history_for_agent(user_id)
     if not input_list:
         input_list = message
     
     # First yield a thinking message
-    yield f"data: {{\"type\": \"loading\", \"content\": \"Processing your request...\"}}\n\n"
+    yield _PROCESSING_FRAME
     
-    # Create a modified context for HTTP streaming
-    stream_context = dict(context or {})
-    
-    # Reset tool notification tracking for this run - using a dictionary now instead of a set
-    stream_context['sent_tool_notifications'] = {}
-    
-    # Add the user context as a reference for persistent data
-    stream_context['user_context'] = context
-    
-    # Create a task to process the agent's response
-    process_task = asyncio.create_task(
-        CustomRunner.run(
-            moby_agent,
+    # Queue that fans in tool progress (pushed by the tools via the context)
+    # and model token deltas, so the client sees tool activity as it happens
+    event_queue = asyncio.Queue()
+
+    # Layer a per-request overlay over the user context for HTTP streaming -
+    # avoids cloning the whole context dict on every message
+    stream_context = ChainMap({
+        # Reset tool notification tracking for this run; markers are
+        # (tool, call_id, status) tuples
+        'sent_tool_notifications': set(),
+        # Add the user context as a reference for persistent data
+        'user_context': context,
+        # Tools push progress events here for SSE forwarding
+        'event_queue': event_queue
+    }, context or {})
+
+    # Start a streamed run so we can forward model tokens as they arrive
+    try:
+        result = CustomRunner.run_streamed(
+            agent.moby_agent,
             input_list,
             context=stream_context
         )
-    )
-    
-    # Wait for the task to complete, capturing any exceptions
-    try:
-        result = await process_task
-        
+
+        # Accumulate deltas for chat history while streaming them to the client
+        full_response = ""
+
+        async def pump_model_events():
+            # Forward model token deltas into the shared event queue, then
+            # mark the run as finished so the forwarding loop can exit
+            nonlocal full_response
+            try:
+                async for event in result.stream_events():
+                    # Raw response events carry the token deltas from the model
+                    if event.type == "raw_response_event":
+                        delta = getattr(event.data, 'delta', None)
+                        if isinstance(delta, str) and delta:
+                            full_response += delta
+                            event_queue.put_nowait({"type": "partial", "content": full_response})
+            finally:
+                event_queue.put_nowait(_STREAM_DONE)
+
+        pump_task = asyncio.create_task(pump_model_events())
+        try:
+            # Forward queued events (tool notifications and partials) in
+            # order. Partial snapshots are cumulative, so when the model
+            # outruns the client and several queue up, only the newest in a
+            # run needs to reach the wire - collapsing them keeps emitted
+            # bytes linear in response size instead of quadratic.
+            finished = False
+            while not finished:
+                batch = [await event_queue.get()]
+                while True:
+                    try:
+                        batch.append(event_queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+
+                pending_partial = None
+                for event in batch:
+                    if event is _STREAM_DONE:
+                        finished = True
+                        break
+                    if event.get("type") == "partial":
+                        # A newer snapshot supersedes the buffered one
+                        pending_partial = event
+                        continue
+                    if pending_partial is not None:
+                        yield sse_frame(pending_partial)
+                        pending_partial = None
+                    yield sse_frame(event)
+
+                if pending_partial is not None:
+                    yield sse_frame(pending_partial)
+
+            # Surface any exception raised inside the streamed run
+            await pump_task
+        finally:
+            if not pump_task.done():
+                pump_task.cancel()
+
         # Format the response safely
         try:
             response_content = format_agent_response(result.final_output)
         except Exception as format_error:
             # If there's an error formatting the output, return a simpler response
             log(f"Error formatting response: {str(format_error)}")
-            if hasattr(result, 'final_output') and result.final_output is not None:
+            if getattr(result, 'final_output', None) is not None:
                 response_content = str(result.final_output)
+            elif full_response:
+                response_content = full_response
             else:
                 response_content = "I'm sorry, I wasn't able to generate a proper response."
-        
-        # Send a short thinking message
-        yield f"data: {{\"type\": \"loading\", \"content\": \"Preparing response...\"}}\n\n"
-        
-        # Split the response into words to simulate token-by-token generation
-        words = response_content.split()
-        accumulated_text = ""
-        
-        # Stream each word with a minor delay
-        for i, word in enumerate(words):
-            accumulated_text += word + " "
-            
-            # Send partial update for each chunk of words (simulate token streaming)
-            if i % 5 == 0 or i == len(words) - 1:
-                yield f"data: {{\"type\": \"partial\", \"content\": \"{accumulated_text.strip()}\"}}\n\n"
-                await asyncio.sleep(0.05)  # Small delay between chunks
-        
+
         # Send the final completed message
-        yield f"data: {{\"type\": \"content\", \"content\": \"{response_content}\"}}\n\n"
-        
+        yield sse_frame({"type": "content", "content": response_content})
+
+        # Cache the response so an identical retry can skip the LLM round trip
+        if cache_key is not None:
+            state.cache_response(cache_key, response_content)
+
         # Add to chat history
-        state.add_message_to_history(user_id, "assistant", response_content, get_timestamp())
+        await state.add_message_to_history(user_id, "assistant", response_content, get_timestamp())
         
     except Exception as e:
         # Handle errors
         error_msg = f"Error processing your request: {str(e)}"
         log(f"Error: {error_msg}", "ERROR")
-        yield f"data: {{\"type\": \"error\", \"content\": \"{error_msg}\"}}\n\n"
+        yield sse_frame({"type": "error", "content": error_msg})
         
         # Add error message to chat history
-        state.add_message_to_history(
-            user_id, 
-            "system", 
+        await state.add_message_to_history(
+            user_id,
+            "system",
             error_msg,
             get_timestamp()
         )
 
 # Define the HTTP API routes
 @router.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: Request):
     """
     Handle chat request via HTTP API
     """
     try:
-        # Process the chat request
+        # Decode the raw body with msgspec - cheaper than Pydantic validation
+        chat_request = decode_chat_request(await request.body())
+
+        # Process the chat request, batching small frames per event-loop tick
         return StreamingResponse(
-            stream_agent_response(request.user_id, request.message),
+            buffered_sse_stream(stream_agent_response(chat_request.user_id, chat_request.message)),
             media_type="text/event-stream"
         )
     except Exception as e:
         log(f"Error in /chat endpoint: {str(e)}", "ERROR")
         return {"error": str(e)}
 
+@router.post("/chat/batch")
+async def chat_batch(request: Request):
+    """
+    Handle multiple chat requests in one call, running the agent concurrently.
+    Useful for evals and background jobs that would otherwise issue N roundtrips.
+    """
+    try:
+        requests = decode_chat_request_list(await request.body())
+
+        inputs = []
+        contexts = []
+        timestamp = get_timestamp()
+
+        # Record each user message and build the per-request agent input
+        for request in requests:
+            context = await state.get_or_create_user_context(request.user_id)
+            await state.add_message_to_history(request.user_id, "user", request.message, timestamp)
+
+            input_list = await state.format_history_for_agent(request.user_id)
+            if not input_list:
+                input_list = request.message
+
+            inputs.append(input_list)
+            contexts.append(dict(context))
+
+        results = await CustomRunner.run_batch(agent.moby_agent, inputs, contexts=contexts)
+
+        responses = []
+        for request, result in zip(requests, results):
+            try:
+                response_content = format_agent_response(result.final_output)
+            except Exception as format_error:
+                log(f"Error formatting batch response: {str(format_error)}")
+                response_content = str(getattr(result, 'final_output', None) or
+                                       "I'm sorry, I wasn't able to generate a proper response.")
+
+            await state.add_message_to_history(request.user_id, "assistant", response_content, get_timestamp())
+            responses.append(ChatResponse(
+                message=response_content,
+                thread_id=contexts[len(responses)].get('thread_id', request.user_id)
+            ))
+
+        return Response(content=encode_json(responses), media_type="application/json")
+    except Exception as e:
+        log(f"Error in /chat/batch endpoint: {str(e)}", "ERROR")
+        return {"error": str(e)}
+
 @router.get("/health")
 async def health_check():
     """
     Health check endpoint to verify the API is running properly
     """
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {"status": "healthy", "timestamp": get_iso_timestamp()}
 
 @router.get("/chat/{user_id}/history")
-async def get_chat_history_http(user_id: str):
-    """Get the chat history for a user"""
-    return {"messages": state.get_chat_history(user_id)}
+async def get_chat_history_http(user_id: str, limit: Optional[int] = None):
+    """Get the chat history for a user; `?limit=N` returns only the tail."""
+    return {"messages": state.get_chat_history(user_id, limit)}
 
 @router.delete("/chat/{user_id}")
 async def clear_chat_history_http(user_id: str):
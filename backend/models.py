@@ -1,9 +1,13 @@
 """
-Pydantic models for the Triple Whale agent system.
+Request/response models for the Triple Whale agent system.
+
+The hot-path chat models use msgspec (C-implemented) so request decode and
+response encode skip Pydantic's per-field validation loop; the remaining
+models stay on Pydantic.
 """
-from typing import Optional, List, Dict, Any
+from typing import Optional, List
+import msgspec
 from pydantic import BaseModel
-from datetime import datetime
 
 class Message(BaseModel):
     """Model for a chat message"""
@@ -11,12 +15,12 @@ class Message(BaseModel):
     content: str
     timestamp: Optional[str] = None
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct, frozen=True):
     """Model for a chat request"""
     user_id: str
     message: str
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct, frozen=True):
     """Model for a chat response"""
     message: str
     thread_id: str
@@ -25,6 +29,23 @@ class UserContext(BaseModel):
     """Model for user context"""
     user_id: str
     # Additional fields can be added as needed
-    
+
     class Config:
-        extra = "allow"  # Allow additional fields not defined in the model 
\ No newline at end of file
+        extra = "allow"  # Allow additional fields not defined in the model
+
+# Cached decoders/encoder for the hot-path chat types
+_chat_request_decoder = msgspec.json.Decoder(ChatRequest)
+_chat_request_list_decoder = msgspec.json.Decoder(List[ChatRequest])
+_json_encoder = msgspec.json.Encoder()
+
+def decode_chat_request(body: bytes) -> ChatRequest:
+    """Decode a raw request body into a ChatRequest."""
+    return _chat_request_decoder.decode(body)
+
+def decode_chat_request_list(body: bytes) -> List[ChatRequest]:
+    """Decode a raw request body into a list of ChatRequests."""
+    return _chat_request_list_decoder.decode(body)
+
+def encode_json(obj) -> bytes:
+    """Encode a msgspec model (or list of them) to JSON bytes."""
+    return _json_encoder.encode(obj)
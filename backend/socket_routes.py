@@ -5,8 +5,12 @@ import asyncio
 import socketio
 import uuid
 import traceback
+from collections import ChainMap
 
-from agent import CustomRunner, moby_agent
+# Resolve the agent lazily on first use so handler registration at startup
+# doesn't build it (agent.py's module __getattr__ does, on first access)
+import agent
+from agent import CustomRunner
 from utils import format_agent_response, log, get_timestamp
 import state
 
@@ -36,10 +40,10 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
             # Add cancellation message to chat history
             if 'user_id' in data:
                 user_id = data['user_id']
-                state.add_message_to_history(
-                    user_id, 
-                    "system", 
-                    "[Response generation was cancelled]", 
+                await state.add_message_to_history(
+                    user_id,
+                    "system",
+                    "[Response generation was cancelled]",
                     get_timestamp()
                 )
             
@@ -62,51 +66,76 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
         
         log(f"Processing message from user {user_id}: {message}", "DEBUG")
         
-        # Initialize or get user context
-        context = state.get_or_create_user_context(user_id)
-        # Add user message to chat history
+        # Initialize or get user context and record the user message
+        # concurrently - the two steps are independent
         timestamp = get_timestamp()
-        state.add_message_to_history(user_id, "user", message, timestamp)
+        context, _ = await asyncio.gather(
+            state.get_or_create_user_context(user_id),
+            state.add_message_to_history(user_id, "user", message, timestamp)
+        )
         
         # Prepare input for the agent using chat history
-        input_list = state.format_history_for_agent(user_id)
+        input_list = await state.format_history_for_agent(user_id)
         if not input_list:
             input_list = message
         
-        # Initial response to let the client know we're processing
-        await sio.emit('stream_update', {
-            "type": "loading", 
-            "content": "Processing your request..."
-        }, room=sid)
-        
         # Create a separate task for processing the response
         async def process_agent_response():
+            full_response = ""
+
+            # Defer the loading frame: when the model answers quickly the
+            # client goes straight to content and saves two round trips.
+            # Only a run still silent after the grace period gets a spinner.
+            first_output = asyncio.Event()
+
+            async def emit_loading_if_slow():
+                await asyncio.sleep(0.15)
+                if not first_output.is_set():
+                    await sio.emit('stream_update', {
+                        "type": "loading",
+                        "content": "Generating response..."
+                    }, room=sid)
+
+            loader_task = asyncio.create_task(emit_loading_if_slow())
+
             try:
                 log(f"Creating task for user {user_id}", "DEBUG")
-                
-                # First, send a loading message
-                await sio.emit('stream_update', {
-                    "type": "loading", 
-                    "content": "Generating response..."
-                }, room=sid)
-                
-                # Reset tool notification tracking for this run - using a dictionary now instead of a set
-                context['sent_tool_notifications'] = {}
-                
+
                 # Now, run the agent to get the response
                 log(f"Running agent for user {user_id}", "DEBUG")
-                # Create a request context that has a reference to the user context
-                request_context = dict(context)
-                # Add the user context as a reference for persistent data
-                request_context['user_context'] = context
+                # Layer a per-request overlay over the persistent user context
+                # instead of cloning it; per-run tool bookkeeping lands here
+                request_context = ChainMap({
+                    # Reset tool notification tracking for this run; markers
+                    # are (tool, call_id, status) tuples
+                    'sent_tool_notifications': set(),
+                    # Add the user context as a reference for persistent data
+                    'user_context': context
+                }, context)
                 
-                result = await CustomRunner.run(
-                    moby_agent, 
-                    input_list, 
+                result = CustomRunner.run_streamed(
+                    agent.moby_agent,
+                    input_list,
                     context=request_context,
                     socket=sio,
                     sid=sid
                 )
+
+                # Stream real token deltas to the client as they arrive
+                async for event in result.stream_events():
+                    # Raw response events carry the token deltas from the model
+                    if event.type == "raw_response_event":
+                        delta = getattr(event.data, 'delta', None)
+                        if isinstance(delta, str) and delta:
+                            first_output.set()
+                            full_response += delta
+                            # Coalesce bursts of deltas into one frame per
+                            # write window; newer snapshots supersede older
+                            state.schedule_partial_emit(sio, sid, {
+                                "type": "partial",
+                                "content": full_response
+                            })
+
                 log(f"Agent run completed for user {user_id}")
                 
                 # Format the response safely
@@ -115,66 +144,48 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 except Exception as format_error:
                     # If there's an error formatting the output, return a simpler response
                     log(f"Error formatting response: {str(format_error)}")
-                    if hasattr(result, 'final_output') and result.final_output is not None:
+                    if getattr(result, 'final_output', None) is not None:
                         response_content = str(result.final_output)
+                    elif full_response:
+                        response_content = full_response
                     else:
                         response_content = "I'm sorry, I wasn't able to generate a proper response."
                 
                 # Store the full response for chat history
                 full_response = response_content
                 
-                # Split the response into words to simulate token-by-token generation
-                words = response_content.split()
-                chunks = []
-                
-                # Create chunks of approximately 5-10 words
-                chunk_size = min(max(len(words) // 10, 5), 10)  # Between 5-10 words per chunk
-                if chunk_size < 1:
-                    chunk_size = 1
-                    
-                for i in range(0, len(words), chunk_size):
-                    end = min(i + chunk_size, len(words))
-                    chunk = ' '.join(words[i:end])
-                    chunks.append(chunk)
-                
-                # Keep track of accumulated text to send progressive updates
-                accumulated_text = ""
-                
-                log(f"Streaming response to user {user_id} in {len(chunks)} chunks")
-                
-                # Stream each chunk with a small delay between them
-                for i, chunk in enumerate(chunks):
-                    accumulated_text += chunk + " "
-                    
-                    # Send the accumulated text so far
-                    await sio.emit('stream_update', {
-                        "type": "partial", 
-                        "content": accumulated_text.strip()
-                    }, room=sid)
-                    
-                    # Add a slight delay between chunks
-                    await asyncio.sleep(0.05)
-                    
-                    # Log progress occasionally
-                    if i % 10 == 0:
-                        log(f"Streamed {i}/{len(chunks)} chunks to user {user_id}")
-                
-                # Send the final completed message
+                # Send the final completed message; it supersedes any
+                # partial still sitting in the write buffer
+                state.discard_pending_emit(sid)
                 log(f"Sending final response to user {user_id}")
                 await sio.emit('stream_update', {
                     "type": "content", 
                     "content": full_response
                 }, room=sid)
                 
-                # Add assistant response to chat history
-                state.add_message_to_history(user_id, "assistant", full_response, get_timestamp())
-                
-                # Remove task from active tasks
+                # Add assistant response to chat history. Shielded so that a
+                # cancellation landing mid-write can't leave the conversation
+                # half-recorded.
+                await asyncio.shield(
+                    state.add_message_to_history(user_id, "assistant", full_response, get_timestamp())
+                )
+
                 log(f"Completing task for user {user_id}")
-                state.remove_active_task(sid, asyncio.current_task())
-                    
+
             except asyncio.CancelledError:
                 log(f"Task cancelled for user {user_id}", "WARNING")
+                # Preserve whatever was streamed before the cancel so the
+                # history stays consistent; shield keeps the write itself
+                # from being cancelled, then re-raise to finish cancelling.
+                if full_response:
+                    await asyncio.shield(
+                        state.add_message_to_history(
+                            user_id,
+                            "assistant",
+                            full_response,
+                            get_timestamp()
+                        )
+                    )
                 raise
             except Exception as e:
                 log(f"Error processing agent response: {str(e)}", "ERROR")
@@ -182,22 +193,30 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 
                 # Send error message to the client
                 error_msg = f"Sorry, there was an error processing your request: {str(e)}"
+                state.discard_pending_emit(sid)
                 await sio.emit('stream_update', {
                     "type": "error",
                     "content": error_msg
                 }, room=sid)
                 
-                # Add error message to chat history
-                state.add_message_to_history(
-                    user_id, 
-                    "system", 
-                    error_msg,
-                    get_timestamp()
+                # Add error message to chat history (shielded: a disconnect
+                # racing the error path shouldn't drop the record)
+                await asyncio.shield(
+                    state.add_message_to_history(
+                        user_id,
+                        "system",
+                        error_msg,
+                        get_timestamp()
+                    )
                 )
-                
-                # Remove task from active tasks
-                state.remove_active_task(sid, asyncio.current_task())
-        
+            finally:
+                # Whatever path we exited on, the spinner is now moot
+                first_output.set()
+                loader_task.cancel()
+
+        # The done callback attached in register_active_task removes the
+        # task from active_tasks on completion, cancellation or error.
+
         # Create a task for processing the response
         task = asyncio.create_task(process_agent_response())
         
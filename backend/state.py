@@ -1,66 +1,287 @@
 """
 State management for the Triple Whale agent system.
 """
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
 from models import UserContext
 
-# User context storage
-user_contexts: Dict[str, Dict[str, Any]] = {}
-chat_histories: Dict[str, List[Dict[str, Any]]] = {}
+class Msg:
+    """Compact chat-history record; slots cut per-message overhead ~5x vs dicts."""
+    __slots__ = ('role', 'content', 'timestamp')
 
-# Track active generation tasks - for cancellation
-active_tasks: Dict[str, List[asyncio.Task]] = {}
+    def __init__(self, role: str, content: str, timestamp: str):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
 
-def get_or_create_user_context(user_id: str) -> Dict[str, Any]:
-    """Initialize user context if not exists and return it."""
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+# User context storage. Contexts are LRU-bounded so idle users eventually
+# drop out; per-user histories are bounded deques so memory stays capped for
+# long-lived conversations.
+MAX_TRACKED_USERS = int(os.getenv('MAX_TRACKED_USERS', '50000'))
+MAX_CHAT_HISTORY_MESSAGES = int(os.getenv('MAX_CHAT_HISTORY_MESSAGES', '200'))
+user_contexts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+chat_histories: Dict[str, "deque[Msg]"] = {}
+
+# Agent-shaped history maintained incrementally alongside chat_histories, so
+# each turn appends one dict instead of rebuilding the whole list. Bounded to
+# cap prompt size for long-lived conversations.
+MAX_AGENT_HISTORY_MESSAGES = int(os.getenv('MAX_AGENT_HISTORY_MESSAGES', '100'))
+_formatted_histories: Dict[str, deque] = {}
+
+# Materialized list snapshots of _formatted_histories, invalidated on append.
+# The message dicts themselves are shared (created once per message), so a
+# snapshot is just the list spine; repeat formats between appends (batch
+# requests, retries) reuse it with zero allocation.
+_formatted_snapshots: Dict[str, List[Dict[str, str]]] = {}
+
+# Track active generation tasks - for cancellation. Sets give O(1)
+# registration and removal; the list rebuild in the old remove path was
+# O(n) per completed task.
+active_tasks: Dict[str, set] = {}
+
+# In-process response cache (opt-in via ENABLE_RESPONSE_CACHE) - serves
+# repeated prompts (reconnect retries, "regenerate" clicks) without another
+# LLM round trip. Disabled by default since time-sensitive tools like
+# forecasting can go stale. Maps (user_id, digest) -> (expires_at, response).
+RESPONSE_CACHE_ENABLED = os.getenv('ENABLE_RESPONSE_CACHE', '').lower() in ('1', 'true', 'yes')
+_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '300'))
+_RESPONSE_CACHE_MAX_ENTRIES = 1024
+_response_cache: "OrderedDict[Tuple[str, bytes], Tuple[float, str]]" = OrderedDict()
+
+def get_or_create_user_context_sync(user_id: str) -> Dict[str, Any]:
+    """Initialize user context if not exists and return it (sync fast path)."""
     if user_id not in user_contexts:
-        user_contexts[user_id] = {"user_id": user_id}
-        chat_histories[user_id] = []
-    
+        # Assign the correlation thread_id once per user instead of minting a
+        # fresh UUID per response
+        user_contexts[user_id] = {"user_id": user_id, "thread_id": uuid.uuid4().hex}
+        chat_histories[user_id] = deque(maxlen=MAX_CHAT_HISTORY_MESSAGES)
+
+        # Evict the least recently seen users once over capacity
+        while len(user_contexts) > MAX_TRACKED_USERS:
+            evicted, _ = user_contexts.popitem(last=False)
+            chat_histories.pop(evicted, None)
+            _formatted_histories.pop(evicted, None)
+            _formatted_snapshots.pop(evicted, None)
+            invalidate_response_cache(evicted)
+    else:
+        user_contexts.move_to_end(user_id)
+
     return user_contexts[user_id]
 
-def add_message_to_history(user_id: str, role: str, content: str, timestamp: str):
-    """Add a message to the user's chat history."""
+async def get_or_create_user_context(user_id: str) -> Dict[str, Any]:
+    """Initialize user context if not exists and return it.
+
+    Async so the storage can move to a database later without changing callers.
+    """
+    return get_or_create_user_context_sync(user_id)
+
+def add_message_to_history_sync(user_id: str, role: str, content: str, timestamp: str):
+    """Add a message to the user's chat history (sync fast path)."""
     if user_id not in chat_histories:
-        chat_histories[user_id] = []
-    
-    chat_histories[user_id].append({
-        "role": role,
-        "content": content,
-        "timestamp": timestamp
-    })
+        chat_histories[user_id] = deque(maxlen=MAX_CHAT_HISTORY_MESSAGES)
+
+    chat_histories[user_id].append(Msg(role, content, timestamp))
+
+    # Keep the agent-shaped history in sync (system messages are skipped)
+    if role in ("user", "assistant"):
+        if user_id not in _formatted_histories:
+            _formatted_histories[user_id] = deque(maxlen=MAX_AGENT_HISTORY_MESSAGES)
+        _formatted_histories[user_id].append({"role": role, "content": content})
+        _formatted_snapshots.pop(user_id, None)
+
+async def add_message_to_history(user_id: str, role: str, content: str, timestamp: str):
+    """Add a message to the user's chat history."""
+    add_message_to_history_sync(user_id, role, content, timestamp)
+
+def response_cache_key(user_id: str, message: str) -> Tuple[str, bytes]:
+    """Build a cache key from the history before this exchange plus the message.
+
+    Retries ("regenerate", reconnect replays) arrive after the original
+    exchange was already recorded, so trailing copies of this exchange - a
+    lone pending user message or completed (user, assistant) pairs where the
+    user message equals `message` - are excluded from the digest. The first
+    attempt and any retry therefore hash the same prefix and share a key.
+    """
+    history = format_history_for_agent_sync(user_id) or []
+    end = len(history)
+    if end and history[end - 1]["role"] == "user" and history[end - 1]["content"] == message:
+        end -= 1
+    while (end >= 2
+           and history[end - 1]["role"] == "assistant"
+           and history[end - 2]["role"] == "user"
+           and history[end - 2]["content"] == message):
+        end -= 2
+    digest = hashlib.blake2b(
+        repr(history[:end]).encode('utf-8') + b'\x00' + message.encode('utf-8'),
+        digest_size=16
+    ).digest()
+    return (user_id, digest)
+
+def get_cached_response(key: Tuple[str, bytes]) -> Optional[str]:
+    """Return a cached response for the key, or None if absent/expired."""
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+
+    expires_at, response = entry
+    if time.monotonic() > expires_at:
+        del _response_cache[key]
+        return None
+
+    # Refresh LRU position on hit
+    _response_cache.move_to_end(key)
+    return response
+
+def cache_response(key: Tuple[str, bytes], response: str):
+    """Store a response in the cache, evicting the oldest entries if full."""
+    _response_cache[key] = (time.monotonic() + _RESPONSE_CACHE_TTL_SECONDS, response)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > _RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+def invalidate_response_cache(user_id: str):
+    """Drop all cached responses for a user."""
+    for key in [k for k in _response_cache if k[0] == user_id]:
+        del _response_cache[key]
 
 def clear_chat_history(user_id: str):
     """Clear a user's chat history."""
     if user_id in chat_histories:
-        chat_histories[user_id] = []
+        chat_histories[user_id].clear()
+    if user_id in _formatted_histories:
+        _formatted_histories[user_id].clear()
+    _formatted_snapshots.pop(user_id, None)
+    invalidate_response_cache(user_id)
 
-def get_chat_history(user_id: str) -> List[Dict[str, Any]]:
-    """Get a user's chat history."""
-    if user_id not in chat_histories:
-        return []
-    
-    return chat_histories[user_id]
+def get_chat_history(user_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get a user's chat history, optionally only the last `limit` messages."""
+    history = chat_histories.get(user_id, ())
+    if limit is not None and 0 < limit < len(history):
+        history = islice(history, len(history) - limit, None)
+    return [msg.to_dict() for msg in history]
 
-def format_history_for_agent(user_id: str):
-    """Format chat history for input to the agent."""
-    if user_id not in chat_histories or len(chat_histories[user_id]) <= 0:
+def format_history_for_agent_sync(user_id: str):
+    """Format chat history for input to the agent (sync fast path).
+
+    Returns a snapshot list that callers must treat as read-only; the
+    message dicts inside it are shared with the live history.
+    """
+    formatted = _formatted_histories.get(user_id)
+    if not formatted:
         return None
-    
-    # Convert chat history to input list format for the agent
-    input_list = []
-    for msg in chat_histories[user_id]:
-        if msg["role"] in ["user", "assistant"]:  # Skip system messages
-            input_list.append({"role": msg["role"], "content": msg["content"]})
-    
-    return input_list
+
+    snapshot = _formatted_snapshots.get(user_id)
+    if snapshot is None:
+        snapshot = list(formatted)
+        _formatted_snapshots[user_id] = snapshot
+    return snapshot
+
+async def format_history_for_agent(user_id: str):
+    """Format chat history for input to the agent."""
+    return format_history_for_agent_sync(user_id)
+
+def has_history(user_id: str) -> bool:
+    """Whether the user has any agent-visible history yet."""
+    return bool(_formatted_histories.get(user_id))
+
+# Per-sid coalescing of cumulative "partial" stream updates. Token deltas can
+# arrive far faster than a client can usefully render; within a short write
+# window only the newest snapshot matters, so buffering collapses bursts into
+# at most one Socket.IO frame per window per connection.
+STREAM_WRITE_DELAY_SECONDS = 0.02
+_pending_partials: Dict[str, Dict[str, Any]] = {}
+_partial_flush_tasks: Dict[str, asyncio.Task] = {}
+
+# Backpressure: bound how many partial emits may be in flight per session.
+# A slow consumer would otherwise grow the server-side send queue without
+# limit; once the bound is hit, intermediate snapshots are dropped (each one
+# supersedes the last anyway) and the final content frame is never gated.
+PARTIAL_MAX_IN_FLIGHT = 16
+_send_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def schedule_partial_emit(sio, sid: str, payload: Dict[str, Any]):
+    """Buffer a cumulative partial update for a session and flush it shortly."""
+    _pending_partials[sid] = payload
+    if sid not in _partial_flush_tasks:
+        _partial_flush_tasks[sid] = asyncio.create_task(_flush_partial_after(sio, sid))
+
+async def _flush_partial_after(sio, sid: str):
+    """Emit the newest buffered partial for a session after the write delay."""
+    try:
+        await asyncio.sleep(STREAM_WRITE_DELAY_SECONDS)
+    finally:
+        _partial_flush_tasks.pop(sid, None)
+
+    payload = _pending_partials.pop(sid, None)
+    if payload is None:
+        return
+
+    sem = _send_semaphores.setdefault(sid, asyncio.Semaphore(PARTIAL_MAX_IN_FLIGHT))
+    if sem.locked():
+        # The client isn't draining; skip this intermediate snapshot rather
+        # than queueing unbounded writes behind it
+        return
+    async with sem:
+        await sio.emit('stream_update', payload, room=sid)
+
+# Tool notifications are batched per sid over a short window: an agent that
+# fires several tools emits one stream_update_batch frame instead of a frame
+# per start/complete event. Unlike partials, every event is kept.
+NOTIFICATION_BATCH_WINDOW_SECONDS = 0.01
+_pending_notifications: Dict[str, List[Dict[str, Any]]] = {}
+_notification_flush_tasks: Dict[str, asyncio.Task] = {}
+
+def schedule_notification_emit(sio, sid: str, payload: Dict[str, Any]):
+    """Queue a tool notification for a session and flush the batch shortly."""
+    _pending_notifications.setdefault(sid, []).append(payload)
+    if sid not in _notification_flush_tasks:
+        _notification_flush_tasks[sid] = asyncio.create_task(
+            _flush_notifications_after(sio, sid)
+        )
+
+async def _flush_notifications_after(sio, sid: str):
+    """Emit the queued notifications for a session after the batch window."""
+    try:
+        await asyncio.sleep(NOTIFICATION_BATCH_WINDOW_SECONDS)
+    finally:
+        _notification_flush_tasks.pop(sid, None)
+
+    events = _pending_notifications.pop(sid, None)
+    if not events:
+        return
+    if len(events) == 1:
+        await sio.emit('stream_update', events[0], room=sid)
+    else:
+        await sio.emit('stream_update_batch', {"events": events}, room=sid)
+
+def discard_pending_emit(sid: str):
+    """Drop any buffered partial for a session (a final frame supersedes it)."""
+    task = _partial_flush_tasks.pop(sid, None)
+    if task is not None:
+        task.cancel()
+    _pending_partials.pop(sid, None)
+    _send_semaphores.pop(sid, None)
 
 def register_active_task(sid: str, task: asyncio.Task):
-    """Register an active task for a session."""
+    """Register an active task for a session.
+
+    A done callback removes the task automatically, so cleanup happens even
+    when the task exits via CancelledError and callers skip their manual
+    `remove_active_task`.
+    """
     if sid not in active_tasks:
-        active_tasks[sid] = []
-    active_tasks[sid].append(task)
+        active_tasks[sid] = set()
+    active_tasks[sid].add(task)
+    task.add_done_callback(lambda t: active_tasks.get(sid, set()).discard(t))
 
 def cancel_active_tasks(sid: str) -> bool:
     """Cancel all active tasks for a session."""
@@ -68,11 +289,12 @@ def cancel_active_tasks(sid: str) -> bool:
         # Cancel all active tasks for this session
         for task in active_tasks[sid]:
             task.cancel()
-        active_tasks[sid] = []
+        active_tasks[sid].clear()
+        discard_pending_emit(sid)
         return True
     return False
 
 def remove_active_task(sid: str, task: asyncio.Task):
     """Remove a task from active tasks."""
     if sid in active_tasks:
-        active_tasks[sid] = [t for t in active_tasks[sid] if t != task] 
\ No newline at end of file
+        active_tasks[sid].discard(task) 
\ No newline at end of file
@@ -2,23 +2,52 @@
 Triple Whale e-commerce tools package.
 This package contains specialized tools for interacting with Triple Whale's services.
 """
+import asyncio
+import importlib
 
-# Import all tools to make them available when importing from the package
-from .text_to_sql import text_to_sql
-from .text_to_python import text_to_python
-from .searching import searching
-from .forecasting import forecasting
-from .marketing_mix_model import marketing_mix_model
-from .preload_dashboard_data import preload_dashboard_data
-from .vision import vision
-from .answer_nlq_question import answer_nlq_question
-from .search_web import search_web
 from .utils import log
 
+# Tool modules are imported on first attribute access (PEP 562), so importing
+# the package - or a single tool - doesn't pay import time for the rest
+_TOOL_NAMES = frozenset({
+    'text_to_sql',
+    'text_to_python',
+    'searching',
+    'forecasting',
+    'marketing_mix_model',
+    'preload_dashboard_data',
+    'vision',
+    'answer_nlq_question',
+    'search_web',
+    'parallel_lookup',
+})
+
+def __getattr__(name):
+    """Resolve a tool on first access and cache it in the package namespace."""
+    if name in _TOOL_NAMES:
+        tool = getattr(importlib.import_module(f".{name}", __name__), name)
+        globals()[name] = tool
+        return tool
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | _TOOL_NAMES)
+
+async def run_tools_parallel(*coros):
+    """
+    Run independent tool coroutines concurrently and gather their results.
+
+    With the tools now on a shared async HTTP client, N concurrent calls cost
+    max(latency) instead of sum(latency) and share one connection pool.
+    Exceptions are returned in place of results rather than raised, so one
+    failing tool doesn't lose the others' output.
+    """
+    return await asyncio.gather(*coros, return_exceptions=True)
+
 # Export all tools
 __all__ = [
     'text_to_sql',
-    'text_to_python', 
+    'text_to_python',
     'searching',
     'forecasting',
     'marketing_mix_model',
@@ -26,5 +55,7 @@ __all__ = [
     'vision',
     'answer_nlq_question',
     'search_web',
-    'log'
-] 
\ No newline at end of file
+    'parallel_lookup',
+    'log',
+    'run_tools_parallel'
+]
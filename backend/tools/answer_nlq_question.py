@@ -1,12 +1,9 @@
 """
 NLQ Question Answering tool for Triple Whale - provides general e-commerce analytics and insights as a fallback.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, _BASE_MOBY_PAYLOAD, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post, singleflight, tool_cache_key, get_cached_tool_result, cache_tool_result, loads
 
 # General NLQ endpoint
 MOBY_ENDPOINT = f"{MOBY_TLD}/willy/answer-nlq-question"
@@ -31,66 +28,64 @@ async def answer_nlq_question(
         Response from the NLQ system
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4()) if not parent_message_id else parent_message_id
-        
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "answer_nlq_question", "starting")
+        fire_notification(context, "answer_nlq_question")
         
         log(f"Answer NLQ Question (fallback) tool called with question: '{question}'", "INFO")
         
         # Set default shop_id if none is provided
         if not shop_id:
             shop_id = "madisonbraids.myshopify.com"
+
+        # Serve repeats of the same question for this shop from the TTL cache
+        cache_key = tool_cache_key("answer_nlq_question", shop_id, question)
+        cached_result = get_cached_tool_result(cache_key)
+        if cached_result is not None:
+            log(f"Answer NLQ Question cache hit for question: '{question}'", "DEBUG")
+            await send_tool_completion_notification(wrapper, "answer_nlq_question")
+            return cached_result
             
-        headers = {
-            'content-type': 'application/json'
-        }
-        
-        # Generate a UUID for conversation if not provided
-        conversation_id = parent_message_id if parent_message_id else str(uuid.uuid4())
-        
-        payload = {
-            "stream": False,
-            "shopId": shop_id,
-            "conversationId": conversation_id,
-            "source": "chat",
-            "dialect": "clickhouse",
-            "userId": "test-user",
-            "additionalShopIds": [],
-            "question": question,
-            "query": question,
-            "generateInsights": True,
-            "isOutsideMainChat": True
-        }
+        async def _do_request() -> str:
+            # Generate an ID for conversation if not provided
+            conversation_id = parent_message_id or fast_id()
 
-        response = requests.post(
-            MOBY_ENDPOINT,
-            headers=headers,
-            json=payload
-        )
+            # Constant fields come from the shared base payload; only the
+            # per-call keys are built here
+            payload = {
+                **_BASE_MOBY_PAYLOAD,
+                "shopId": shop_id,
+                "conversationId": conversation_id,
+                "question": question,
+                "query": question
+            }
 
-        if response.status_code == 200 and response.text.strip():
-            try:
-                data = response.json()
-                
-                if data.get("messages") and len(data["messages"]) > 0:
-                    last_message_text = data["messages"][-1].get("text", "") + " "
-                    await send_tool_completion_notification(wrapper, "answer_nlq_question")
-                    return last_message_text
-                else:
-                    await send_tool_completion_notification(wrapper, "answer_nlq_question")
+            response = await guarded_post(
+                MOBY_ENDPOINT,
+                headers=JSON_HEADERS,
+                json=payload
+            )
+
+            if response.status_code == 200 and response.content and not response.content.isspace():
+                try:
+                    data = loads(response.content)
+
+                    if data.get("messages") and len(data["messages"]) > 0:
+                        last_message_text = data["messages"][-1].get("text", "") + " "
+                        cache_tool_result(cache_key, last_message_text)
+                        return last_message_text
                     return "No answer received from the NLQ system."
-            except json.JSONDecodeError as json_err:
-                log(f"JSON parsing error: {json_err}", "ERROR")
-                await send_tool_completion_notification(wrapper, "answer_nlq_question")
-                return f"Error: Could not parse API response. {str(json_err)}"
-        else:
+                except ValueError as json_err:
+                    log(f"JSON parsing error: {json_err}", "ERROR")
+                    return f"Error: Could not parse API response. {str(json_err)}"
             error_msg = f"Error: API request failed with status {response.status_code}"
             log(error_msg, "ERROR")
-            await send_tool_completion_notification(wrapper, "answer_nlq_question")
             return error_msg
+
+        # Concurrent duplicates of this call share one in-flight request
+        result = await singleflight(cache_key, _do_request)
+        await send_tool_completion_notification(wrapper, "answer_nlq_question")
+        return result
             
     except Exception as e:
         error_msg = f"Error querying NLQ system: {e}"
@@ -1,12 +1,9 @@
 """
 Forecasting tool for Triple Whale - forecasts time series metrics into the future.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post, singleflight, tool_cache_key, get_cached_tool_result, cache_tool_result, dumps, loads
 
 # Forecasting endpoint
 FORECASTING_ENDPOINT = f"{MOBY_TLD}/api/forecasting"
@@ -28,12 +25,12 @@ async def forecasting(
         Time series forecasts and predictive analytics
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
+        # Generate a unique message ID (.hex skips the hyphenated str format)
+        message_id = fast_id()
         
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "forecasting", "starting")
+        fire_notification(context, "forecasting")
         
         log(f"Forecasting tool called with question: '{question}'", "INFO")
         
@@ -43,46 +40,54 @@ async def forecasting(
         # Set default shop_id if none is provided
         if not shop_id:
             shop_id = context.get('shop_id', "madisonbraids.myshopify.com")
-        
-        # Prepare headers and payload for the API call
-        headers = {
-            'content-type': 'application/json'
-        }
-        
-        payload = {
-            "question": question,
-            "userOriginalQuestion": original_question,
-            "shopId": shop_id,
-            "messageId": message_id,
-            "source": "chat",
-            "dialect": "clickhouse",
-            "userId": "test-user"
-        }
-        
-        # Make the direct API call
-        response = requests.post(
-            FORECASTING_ENDPOINT,
-            headers=headers,
-            json=payload
-        )
 
-        log("Forecasting tool completed", "DEBUG")
+        # Serve repeats of the same question for this shop from the TTL cache
+        cache_key = tool_cache_key("forecasting", shop_id, question)
+        cached_result = get_cached_tool_result(cache_key)
+        if cached_result is not None:
+            log(f"Forecasting cache hit for question: '{question}'", "DEBUG")
+            await send_tool_completion_notification(wrapper, "forecasting")
+            return cached_result
         
-        if response.status_code == 200 and response.text.strip():
-            try:
-                data = response.json()
-                # Return the formatted response
-                await send_tool_completion_notification(wrapper, "forecasting")
-                return json.dumps(data)
-            except json.JSONDecodeError as json_err:
-                log(f"JSON parsing error: {json_err}", "ERROR")
-                await send_tool_completion_notification(wrapper, "forecasting")
-                return f"Error: Could not parse API response. {str(json_err)}"
-        else:
+        async def _do_request() -> str:
+            # Prepare the payload for the API call (headers are the shared constant)
+            payload = {
+                "question": question,
+                "userOriginalQuestion": original_question,
+                "shopId": shop_id,
+                "messageId": message_id,
+                "source": "chat",
+                "dialect": "clickhouse",
+                "userId": "test-user"
+            }
+
+            # Make the API call on the shared async client
+            response = await guarded_post(
+                FORECASTING_ENDPOINT,
+                headers=JSON_HEADERS,
+                json=payload
+            )
+
+            log("Forecasting tool completed", "DEBUG")
+
+            if response.status_code == 200 and response.content and not response.content.isspace():
+                try:
+                    data = loads(response.content)
+                    # Cache and return the formatted response
+                    result = dumps(data)
+                    cache_tool_result(cache_key, result)
+                    return result
+                except ValueError as json_err:
+                    log(f"JSON parsing error: {json_err}", "ERROR")
+                    return f"Error: Could not parse API response. {str(json_err)}"
             error_msg = f"Error: API request failed with status {response.status_code}"
             log(error_msg, "ERROR")
-            await send_tool_completion_notification(wrapper, "forecasting")
             return error_msg
+
+        # Concurrent duplicates of this call share one in-flight request
+        result = await singleflight(cache_key, _do_request)
+        await send_tool_completion_notification(wrapper, "forecasting")
+        return result
         
     except Exception as e:
         error_msg = f"Error in Forecasting: {e}"
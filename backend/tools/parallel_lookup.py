@@ -0,0 +1,71 @@
+"""
+Parallel lookup tool for Triple Whale - runs an analytics query and a web search concurrently.
+"""
+import asyncio
+from agents import function_tool, RunContextWrapper
+from typing import Optional
+from .utils import log, fire_notification, send_tool_completion_notification, call_moby_endpoint, dumps
+
+# Same NLQ endpoint the answer_nlq_question fallback uses
+NLQ_ENDPOINT_PATH = "/willy/answer-nlq-question"
+
+@function_tool
+async def parallel_lookup(
+    wrapper: RunContextWrapper,
+    analytics_question: str,
+    web_search_term: str,
+    shop_id: Optional[str] = None
+) -> str:
+    """
+    Answer a question that needs both store analytics and external web info.
+    Runs the analytics lookup and the web search concurrently, so use this
+    instead of calling answer_nlq_question and search_web one after the other.
+
+    Args:
+        analytics_question: The analytics question to ask about the store
+        web_search_term: The search term to look up on the web
+        shop_id: Shopify store URL
+
+    Returns:
+        JSON string with "analytics" and "web" result sections
+    """
+    try:
+        # Send tool notification
+        context = getattr(wrapper, 'context', {})
+        fire_notification(context, "parallel_lookup")
+
+        log(f"Parallel lookup tool called with question: '{analytics_question}' "
+            f"and search term: '{web_search_term}'", "INFO")
+
+        async def _analytics() -> str:
+            data = await call_moby_endpoint(NLQ_ENDPOINT_PATH, analytics_question, shop_id)
+            messages = data.get("messages") if isinstance(data, dict) else None
+            if messages:
+                return messages[-1].get("text", "")
+            return "No answer received from the NLQ system."
+
+        async def _web():
+            return await wrapper.invoke_tool("web_search", {"search_term": web_search_term})
+
+        # Both lookups are independent, so the call costs max(latency) rather
+        # than the sum; one failing leg still returns the other's result
+        analytics_result, web_result = await asyncio.gather(
+            _analytics(), _web(), return_exceptions=True
+        )
+
+        if isinstance(analytics_result, BaseException):
+            log(f"Analytics leg of parallel lookup failed: {analytics_result}", "ERROR")
+            analytics_result = f"Error: {analytics_result}"
+        if isinstance(web_result, BaseException):
+            log(f"Web leg of parallel lookup failed: {web_result}", "ERROR")
+            web_result = f"Error: {web_result}"
+
+        log("Parallel lookup tool completed", "DEBUG")
+        await send_tool_completion_notification(wrapper, "parallel_lookup")
+        return dumps({"analytics": analytics_result, "web": web_result})
+
+    except Exception as e:
+        error_msg = f"Error in parallel_lookup: {e}"
+        log(error_msg, "ERROR")
+        await send_tool_completion_notification(wrapper, "parallel_lookup")
+        return dumps({"error": str(e), "message": "Failed to run the parallel lookup"})
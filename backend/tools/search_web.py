@@ -1,11 +1,9 @@
 """
 Web Search tool for Triple Whale - finds information on the web as a fallback option.
 """
-import uuid
-import json
 from agents import function_tool, RunContextWrapper
 from typing import Optional
-from .utils import log, send_tool_notification, send_tool_completion_notification
+from .utils import log, fire_notification, send_tool_notification, send_tool_completion_notification, dumps
 
 @function_tool
 async def search_web(
@@ -22,17 +20,14 @@ async def search_web(
         JSON string with search results
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
-        
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "search_web", "starting")
+        fire_notification(context, "search_web")
         
         log(f"Search web (fallback) tool called with term: '{search_term}'", "INFO")
         
         # Send a starting notification for the secondary web_search tool
-        await send_tool_notification(context, "web_search", "starting")
+        fire_notification(context, "web_search")
         
         # Use the web_search tool from the wrapper
         result = await wrapper.invoke_tool("web_search", {"search_term": search_term})
@@ -41,7 +36,7 @@ async def search_web(
         await send_tool_notification(context, "web_search", "completed")
         
         # Return as JSON
-        response = json.dumps({"source": "web_search", "results": result})
+        response = dumps({"source": "web_search", "results": result})
         
         log("Search web tool completed", "DEBUG")
         await send_tool_completion_notification(wrapper, "search_web")
@@ -59,4 +54,4 @@ async def search_web(
             pass
             
         await send_tool_completion_notification(wrapper, "search_web")
-        return json.dumps({"error": str(e), "message": "Failed to search the web"}) 
\ No newline at end of file
+        return dumps({"error": str(e), "message": "Failed to search the web"}) 
\ No newline at end of file
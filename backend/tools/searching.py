@@ -1,12 +1,9 @@
 """
 Searching tool for Triple Whale - provides information about the platform and e-commerce.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional, List
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post
 
 # Searching endpoint
 SEARCHING_ENDPOINT = f"{MOBY_TLD}/api/search"
@@ -32,12 +29,12 @@ async def searching(
         Information and search results related to the query
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
+        # Generate a unique message ID (.hex skips the hyphenated str format)
+        message_id = fast_id()
         
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "searching", "starting")
+        fire_notification(context, "searching")
         
         log(f"Searching tool called with question: '{question}'", "INFO")
         
@@ -52,11 +49,7 @@ async def searching(
         if not searchSource:
             searchSource = ['webSearch']
         
-        # Prepare headers and payload for the API call
-        headers = {
-            'content-type': 'application/json'
-        }
-        
+        # Prepare the payload for the API call (headers are the shared constant)
         payload = {
             "question": question,
             "originalQuestion": original_question,
@@ -68,25 +61,28 @@ async def searching(
             "userId": "test-user"
         }
         
-        # Make the direct API call
-        response = requests.post(
+        # Make the API call on the shared async client
+        response = await guarded_post(
             SEARCHING_ENDPOINT,
-            headers=headers,
+            headers=JSON_HEADERS,
             json=payload
         )
 
         log("Searching tool completed", "DEBUG")
         
-        if response.status_code == 200 and response.text.strip():
-            try:
-                data = response.json()
-                # Return the formatted response
+        body = response.content
+        if response.status_code == 200 and body and not body.isspace():
+            # Pass the body through untouched: parsing and re-serializing a
+            # JSON payload nothing inspects is pure overhead on large results.
+            # The sanity check runs on bytes so non-JSON bodies never pay for
+            # a full decode.
+            if body.lstrip()[:1] in (b'{', b'['):
+                text = response.text
                 await send_tool_completion_notification(wrapper, "searching")
-                return json.dumps(data)
-            except json.JSONDecodeError as json_err:
-                log(f"JSON parsing error: {json_err}", "ERROR")
-                await send_tool_completion_notification(wrapper, "searching")
-                return f"Error: Could not parse API response. {str(json_err)}"
+                return text
+            log("Response was not JSON", "ERROR")
+            await send_tool_completion_notification(wrapper, "searching")
+            return "Error: Could not parse API response."
         else:
             error_msg = f"Error: API request failed with status {response.status_code}"
             log(error_msg, "ERROR")
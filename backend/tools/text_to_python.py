@@ -1,16 +1,17 @@
 """
 TextToPython tool for Triple Whale - converts natural language to executable Python code.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post
 
 # TextToPython endpoint
 TEXT_TO_PYTHON_ENDPOINT = f"{MOBY_TLD}/api/code-interpreter"
 
+# Fallback for wrappers that never ran a retry loop; shared so the
+# getattr default allocates nothing per call
+_NO_RUN_COUNTS = {}
+
 @function_tool
 async def text_to_python(
     wrapper: RunContextWrapper, 
@@ -28,12 +29,12 @@ async def text_to_python(
         Python code execution results and output
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
+        # Generate a unique message ID (.hex skips the hyphenated str format)
+        message_id = fast_id()
         
         # Send tool notification for start
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "text_to_python", "starting")
+        fire_notification(context, "text_to_python")
         
         log(f"TextToPython tool called with question: '{question}'", "INFO")
         
@@ -45,15 +46,11 @@ async def text_to_python(
             shop_id = context.get('shop_id', "madisonbraids.myshopify.com")
         
         # Check if we're retrying or have pre-generated code
-        current_run_index = 0
-        if hasattr(wrapper, 'run_count') and wrapper.run_count.get('text_to_python'):
-            current_run_index = wrapper.run_count.get('text_to_python')
-        
-        # Prepare headers and payload for the API call
-        headers = {
-            'content-type': 'application/json'
-        }
+        # getattr with a shared empty-dict default skips the hasattr
+        # try/except and the second dict lookup on this hot path
+        current_run_index = getattr(wrapper, 'run_count', _NO_RUN_COUNTS).get('text_to_python', 0)
         
+        # Prepare the payload for the API call (headers are the shared constant)
         payload = {
             "question": question,
             "originalQuestion": original_question,
@@ -66,27 +63,30 @@ async def text_to_python(
             "userId": "test-user"
         }
         
-        # Make the direct API call
-        response = requests.post(
+        # Make the API call on the shared async client
+        response = await guarded_post(
             TEXT_TO_PYTHON_ENDPOINT,
-            headers=headers,
+            headers=JSON_HEADERS,
             json=payload
         )
 
         log("TextToPython tool completed", "DEBUG")
         
-        if response.status_code == 200 and response.text.strip():
-            try:
-                data = response.json()
+        body = response.content
+        if response.status_code == 200 and body and not body.isspace():
+            # Pass the body through untouched: parsing and re-serializing a
+            # JSON payload nothing inspects is pure overhead on large results.
+            # The sanity check runs on bytes so non-JSON bodies never pay for
+            # a full decode.
+            if body.lstrip()[:1] in (b'{', b'['):
+                text = response.text
                 # Send tool notification for completion
                 await send_tool_completion_notification(wrapper, "text_to_python")
-                # Return the formatted response
-                return json.dumps(data)
-            except json.JSONDecodeError as json_err:
-                log(f"JSON parsing error: {json_err}", "ERROR")
-                # Send tool notification for completion (with error)
-                await send_tool_completion_notification(wrapper, "text_to_python")
-                return f"Error: Could not parse API response. {str(json_err)}"
+                return text
+            log("Response was not JSON", "ERROR")
+            # Send tool notification for completion (with error)
+            await send_tool_completion_notification(wrapper, "text_to_python")
+            return "Error: Could not parse API response."
         else:
             error_msg = f"Error: API request failed with status {response.status_code}"
             log(error_msg, "ERROR")
@@ -1,16 +1,17 @@
 """
 TextToSQL tool for Triple Whale - converts natural language to SQL queries.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional, Dict, Any
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post
 
 # TextToSQL endpoint
 TEXT_TO_SQL_ENDPOINT = f"{MOBY_TLD}/api/sql-generator"
 
+# Fallback for wrappers that never ran a retry loop; shared so the
+# getattr default allocates nothing per call
+_NO_RUN_COUNTS = {}
+
 @function_tool
 async def text_to_sql(
     wrapper: RunContextWrapper, 
@@ -30,12 +31,12 @@ async def text_to_sql(
         Data results and SQL query information
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
+        # Generate a unique message ID (.hex skips the hyphenated str format)
+        message_id = fast_id()
         
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "text_to_sql", "starting")
+        fire_notification(context, "text_to_sql")
         
         log(f"TextToSQL tool called with question: '{question}'", "INFO")
         
@@ -47,15 +48,11 @@ async def text_to_sql(
             shop_id = context.get('shop_id', "madisonbraids.myshopify.com")
         
         # Check if we should retry editing a query
-        current_run_index = 0
-        if hasattr(wrapper, 'run_count') and wrapper.run_count.get('text_to_sql'):
-            current_run_index = wrapper.run_count.get('text_to_sql')
-        
-        # Prepare headers and payload for the API call
-        headers = {
-            'content-type': 'application/json'
-        }
+        # getattr with a shared empty-dict default skips the hasattr
+        # try/except and the second dict lookup on this hot path
+        current_run_index = getattr(wrapper, 'run_count', _NO_RUN_COUNTS).get('text_to_sql', 0)
         
+        # Prepare the payload for the API call (headers are the shared constant)
         payload = {
             "question": question,
             "originalQuestion": original_question,
@@ -70,26 +67,29 @@ async def text_to_sql(
         if current_run_index > 0:
             payload["tryEditQuery"] = True
         
-        # Make the direct API call
-        response = requests.post(
+        # Make the API call on the shared async client
+        response = await guarded_post(
             TEXT_TO_SQL_ENDPOINT,
-            headers=headers,
+            headers=JSON_HEADERS,
             json=payload
         )
 
         log("TextToSQL tool completed", "DEBUG")
 
         
-        if response.status_code == 200 and response.text.strip():
-            try:
-                data = response.json()
-                # Return the formatted response
+        body = response.content
+        if response.status_code == 200 and body and not body.isspace():
+            # Pass the body through untouched: parsing and re-serializing a
+            # JSON payload nothing inspects is pure overhead on large results.
+            # The sanity check runs on bytes so non-JSON bodies never pay for
+            # a full decode.
+            if body.lstrip()[:1] in (b'{', b'['):
+                text = response.text
                 await send_tool_completion_notification(wrapper, "text_to_sql")
-                return json.dumps(data)
-            except json.JSONDecodeError as json_err:
-                log(f"JSON parsing error: {json_err}", "ERROR")
-                await send_tool_completion_notification(wrapper, "text_to_sql")
-                return f"Error: Could not parse API response. {str(json_err)}"
+                return text
+            log("Response was not JSON", "ERROR")
+            await send_tool_completion_notification(wrapper, "text_to_sql")
+            return "Error: Could not parse API response."
         else:
             error_msg = f"Error: API request failed with status {response.status_code}"
             log(error_msg, "ERROR")
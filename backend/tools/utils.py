@@ -1,21 +1,227 @@
 """
 Utility functions and shared constants for Triple Whale tools.
 """
+import os
 import sys
 import json
-import uuid
+import random
+import hashlib
+import time
 import asyncio
-import requests
+import httpx
+from collections import OrderedDict
+from urllib.parse import urlsplit
 from typing import Dict, Any, Optional
 
 # Endpoint configurations
 MOBY_TLD = "http://willy.srv.whale3.io"
 
-# Common utility function for logging with automatic stdout flushing
-def log(message: str, level: str = "INFO"):
-    """Print a message to stdout with a log level and flush the buffer immediately."""
-    print(f"[{level}] {message}")
-    sys.stdout.flush()
+# Constant request pieces, built once instead of per call. Treat as frozen:
+# merge with {**_BASE, ...}, never mutate in place.
+JSON_HEADERS = {'content-type': 'application/json'}
+_BASE_MOBY_PAYLOAD = {
+    "stream": False,
+    "source": "chat",
+    "dialect": "clickhouse",
+    "userId": "test-user",
+    "additionalShopIds": [],
+    "generateInsights": True,
+    "isOutsideMainChat": True
+}
+
+# uuid.uuid4() costs an os.urandom syscall per call. IDs that only need to be
+# unique within this process (message ids, tool-call tracking, tag suffixes)
+# come from a PRNG seeded once from the OS instead. Each process seeds with
+# 256 bits of OS entropy, so 128-bit draws stay unique across workers too;
+# uuid4 remains only for the per-user thread_id minted in state.py.
+_RNG = random.Random(os.urandom(32))
+
+def fast_id() -> str:
+    """Return a 32-char hex id unique within this process, syscall-free."""
+    return _RNG.getrandbits(128).to_bytes(16, 'little').hex()
+
+# Shared async HTTP client: pooled keep-alive connections reused across all
+# tool calls, so tools never block the event loop and skip per-call TCP/TLS
+# handshakes. With HTTP/2 enabled, concurrent tool fan-outs multiplex over a
+# single connection instead of racing for sockets.
+_http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        timeout = httpx.Timeout(30.0, connect=5.0)
+        limits = httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=64,
+            keepalive_expiry=300
+        )
+        # The transport owns pooling and retries transient connect failures;
+        # request-level retry policy stays the circuit breaker's concern
+        try:
+            transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=2)
+        except ImportError:
+            # The h2 extra isn't installed; HTTP/1.1 keep-alive still pools
+            transport = httpx.AsyncHTTPTransport(limits=limits, retries=2)
+        _http_client = httpx.AsyncClient(timeout=timeout, transport=transport)
+    return _http_client
+
+async def aclose_http_client():
+    """Close the shared client's pooled connections (ASGI shutdown hook)."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the upstream circuit is open."""
+
+class CircuitBreaker:
+    """Fast-fail gate for an unhealthy upstream host.
+
+    After `fail_threshold` consecutive failures the breaker opens and calls
+    fail in microseconds instead of each waiting out the full socket timeout.
+    After `reset_after` seconds it lets a probe request through (half-open);
+    one success closes it again.
+    """
+
+    def __init__(self, fail_threshold: int = 5, reset_after: float = 30.0):
+        self.fail_threshold = fail_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def open(self) -> bool:
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            # Half-open: allow one probe; a failure re-opens immediately
+            self._opened_at = None
+            self._failures = self.fail_threshold - 1
+            return False
+        return True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._failures >= self.fail_threshold:
+            self._opened_at = time.monotonic()
+
+# One breaker per upstream host, shared by every tool
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def _breaker_for(url: str) -> CircuitBreaker:
+    host = urlsplit(url).netloc
+    breaker = _circuit_breakers.get(host)
+    if breaker is None:
+        breaker = _circuit_breakers[host] = CircuitBreaker()
+    return breaker
+
+async def guarded_post(url: str, **kwargs) -> httpx.Response:
+    """POST through the shared client with circuit-breaker protection.
+
+    Raises CircuitOpenError without touching the network when the host's
+    breaker is open. Transport errors and 5xx responses count as failures;
+    anything else closes the breaker.
+    """
+    breaker = _breaker_for(url)
+    if breaker.open:
+        raise CircuitOpenError(
+            f"{urlsplit(url).netloc} is temporarily unavailable (circuit open)"
+        )
+
+    try:
+        response = await get_http_client().post(url, **kwargs)
+    except httpx.HTTPError:
+        breaker.record_failure()
+        raise
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+# orjson parses ~5x and serializes 3-10x faster than stdlib json; fall back
+# transparently when it isn't installed. loads() takes the raw response bytes
+# so no intermediate text decode pass is needed.
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        """Serialize an object to a JSON string."""
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return orjson.loads(data)
+except ImportError:
+    def dumps(obj) -> str:
+        """Serialize an object to a JSON string."""
+        return json.dumps(obj)
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+# Bounded TTL cache for idempotent tool calls. Sessions tend to repeat the
+# same (tool, shop, question) requests as a conversation progresses, so a
+# short TTL gives high hit rates without holding stale data for long.
+TOOL_CACHE_TTL_SECONDS = 300
+_TOOL_CACHE_MAX_ENTRIES = 2048
+_tool_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def tool_cache_key(tool_name: str, shop_id: str, question: str) -> str:
+    """Key a tool call on its stable prefix: tool, shop and normalized question."""
+    blob = f"{tool_name}|{shop_id}|{question.strip().lower()}".encode('utf-8')
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def get_cached_tool_result(key: str, ttl: float = TOOL_CACHE_TTL_SECONDS) -> Optional[str]:
+    """Return the cached result for a key, or None if absent or expired."""
+    entry = _tool_cache.get(key)
+    if entry is None:
+        return None
+
+    cached_at, value = entry
+    if time.monotonic() - cached_at >= ttl:
+        del _tool_cache[key]
+        return None
+
+    # Refresh LRU position on hit
+    _tool_cache.move_to_end(key)
+    return value
+
+def cache_tool_result(key: str, value: str):
+    """Store a successful tool result, evicting the oldest entries if full."""
+    _tool_cache[key] = (time.monotonic(), value)
+    _tool_cache.move_to_end(key)
+    while len(_tool_cache) > _TOOL_CACHE_MAX_ENTRIES:
+        _tool_cache.popitem(last=False)
+
+# Tool logging goes through the app's queued logger: level filtering happens
+# before anything is formatted onto the queue, and the listener thread does
+# the stream writes, so tools never pay a flush syscall per message. The
+# print fallback keeps the package importable standalone.
+try:
+    from utils import log
+except ImportError:
+    def log(message: str, level: str = "INFO"):
+        """Print a message to stdout with a log level and flush the buffer immediately."""
+        print(f"[{level}] {message}")
+        sys.stdout.flush()
+
+# Batched notification emits live in the app's state module; fall back to
+# direct emits when the package is imported standalone
+try:
+    from state import schedule_notification_emit
+except ImportError:
+    schedule_notification_emit = None
 
 # Common function to send tool notifications
 async def send_tool_notification(context: Dict[str, Any], tool_name: str, status: str = "starting"):
@@ -33,7 +239,7 @@ async def send_tool_notification(context: Dict[str, Any], tool_name: str, status
         
         # Initialize data structures if they don't exist
         if 'sent_tool_notifications' not in context:
-            context['sent_tool_notifications'] = {}
+            context['sent_tool_notifications'] = set()
             
         if 'tool_call_counters' not in context:
             context['tool_call_counters'] = {}
@@ -55,7 +261,7 @@ async def send_tool_notification(context: Dict[str, Any], tool_name: str, status
         
         if status == "starting":
             # Generate a new unique ID for this specific tool call
-            call_uuid = str(uuid.uuid4())
+            call_uuid = fast_id()
             
             # Increment the global counter for a truly new counter each time
             # Use the counter from the user context to persist across messages
@@ -99,42 +305,59 @@ async def send_tool_notification(context: Dict[str, Any], tool_name: str, status
                 else:
                     log(f"No call ID found for {tool_name}, using default ID 1", "DEBUG")
         
-        # Create a unique key for notification tracking
-        tool_call_key = f"{tool_name}_call_{call_id}"
-        
+        # One marker per (tool, call, status) gives a single O(1) set
+        # membership test. A tuple key skips the per-call string formatting;
+        # the literal tool names are interned by CPython, so hashing and
+        # equality hit the identity fast path.
+        marker = (tool_name, call_id, status)
+
         # Check for duplicate notifications
-        sent_notifications = context.get('sent_tool_notifications', {})
-        if status == "starting" and tool_call_key in sent_notifications and sent_notifications[tool_call_key] == "starting":
-            log(f"Skipping duplicate starting notification for: {tool_call_key}", "DEBUG")
+        sent_notifications = context['sent_tool_notifications']
+        if marker in sent_notifications:
+            log(f"Skipping duplicate {status} notification for: {tool_name} call {call_id}", "DEBUG")
             return False
         
-        # If we have a socket connection, send the notification
-        if socket and sid:
+        # SSE streaming installs a queue in the context for tool progress events
+        event_queue = context.get('event_queue')
+
+        # If we have a socket connection or an event queue, send the notification
+        if (socket and sid) or event_queue is not None:
             log(f"Sending tool notification for: {tool_name} (call #{call_id}, {status})", "DEBUG")
-            
+
             # Different message content based on status
             content = f"Using tool: {tool_name}..." if status == "starting" else f"Tool {tool_name} completed"
-            
+
             # Ensure a unique timestamp for each tool notification to prevent client deduplication
             # Add a unique call counter to each message
-            unique_content = f"{content} [call_{call_id}_{uuid.uuid4().hex[:6]}]"
-            
-            # Send the notification
-            await socket.emit('stream_update', {
+            unique_content = f"{content} [call_{call_id}_{fast_id()[:6]}]"
+
+            payload = {
                 "type": "tool",
                 "content": unique_content,
                 "tool": tool_name,
                 "status": status,
                 "call_id": call_id  # Add call_id to help client track specific calls
-            }, room=sid)
-            
-            # Track that we've sent this notification and its status
-            sent_notifications[tool_call_key] = status
-            
-            # For "starting" notifications, yield control to the event loop to ensure the notification is processed
-            if status == "starting":
-                await asyncio.sleep(0.1)  # Small delay to ensure notifications are processed in order
-                
+            }
+
+            # Push onto the SSE event queue so HTTP clients see tool progress
+            if event_queue is not None:
+                event_queue.put_nowait(payload)
+
+            # Send the notification over the socket if connected. Batching
+            # collapses the start/complete bursts of multi-tool runs into one
+            # frame per window instead of a frame per event.
+            if socket and sid:
+                if schedule_notification_emit is not None:
+                    schedule_notification_emit(socket, sid, payload)
+                else:
+                    await socket.emit('stream_update', payload, room=sid)
+
+            # Track that we've sent this notification and its status.
+            # No ordering sleep is needed: Socket.IO delivers emits in order
+            # per connection, and call_id already gives the client a
+            # monotonic sequence to sort on.
+            sent_notifications.add(marker)
+
             return True
     except Exception as e:
         log(f"Error sending tool notification: {str(e)}", "ERROR")
@@ -142,70 +365,135 @@ async def send_tool_notification(context: Dict[str, Any], tool_name: str, status
     
     return False
 
+def _log_notification_exception(task: asyncio.Task):
+    """Surface failures from fire-and-forget notification tasks."""
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        log(f"Error sending tool notification: {exc}", "ERROR")
+
+def fire_notification(context: Dict[str, Any], tool_name: str, status: str = "starting") -> Optional[asyncio.Task]:
+    """
+    Dispatch a tool notification without waiting for it to be delivered.
+
+    Notifications are informational, so the upstream HTTP call shouldn't sit
+    behind the emit round trip - fire the task and let it overlap the POST.
+    Returns None without scheduling anything when the context has no listener
+    (no socket session and no SSE event queue), e.g. batch or background runs.
+
+    Args:
+        context: The context object containing socket and session information
+        tool_name: The name of the tool being used
+        status: The status of the tool ("starting" or "completed")
+    """
+    if context.get('event_queue') is None and not (
+            context.get('socket') and context.get('sid')):
+        return None
+
+    task = asyncio.create_task(send_tool_notification(context, tool_name, status))
+    task.add_done_callback(_log_notification_exception)
+    return task
+
+# In-flight request map for singleflight deduplication of identical upstream
+# calls; entries remove themselves as each request settles
+_inflight_calls: Dict[str, asyncio.Task] = {}
+
+async def singleflight(key: str, coro_factory):
+    """Share one in-flight request among concurrent callers with the same key.
+
+    Agent retries and parallel sessions can fire the same tool call twice
+    before the first response lands; the first caller starts the request and
+    later callers await the same task, so the backend sees one POST. Failures
+    propagate to every waiter. `coro_factory` is only invoked for the caller
+    that starts the flight.
+    """
+    inflight = _inflight_calls.get(key)
+    if inflight is None:
+        inflight = asyncio.create_task(coro_factory())
+        _inflight_calls[key] = inflight
+        inflight.add_done_callback(lambda _task: _inflight_calls.pop(key, None))
+    return await inflight
+
 # Common function to make requests to Moby endpoints
-async def call_moby_endpoint(endpoint: str, question: str, shop_id: str, 
+async def call_moby_endpoint(endpoint: str, question: str, shop_id: str,
                          conversation_id: Optional[str] = None,
-                         additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                         additional_params: Optional[Dict[str, Any]] = None,
+                         cache: bool = True) -> Dict[str, Any]:
     """
     Makes a request to a Moby endpoint with proper parameters.
-    
+
     Args:
         endpoint: The specific endpoint to call
         question: The question or query for Moby
         shop_id: The Shopify shop ID
         conversation_id: Optional conversation ID for context
         additional_params: Additional parameters to add to the payload
-        
+        cache: Serve repeated calls from the shared TTL cache (default True);
+            pass False for queries that must always hit the backend
+
     Returns:
         Response data from the API call
     """
     # Set default shop_id if none is provided
     if not shop_id:
         shop_id = "madisonbraids.myshopify.com"
-        
-    headers = {
-        'content-type': 'application/json'
-    }
-    
-    # Generate a UUID for conversation if not provided
-    conv_id = conversation_id if conversation_id else str(uuid.uuid4())
-    
-    # Base payload for all Moby calls
-    payload = {
-        "stream": False,
-        "shopId": shop_id,
-        "conversationId": conv_id,
-        "source": "chat",
-        "dialect": "clickhouse",
-        "userId": "test-user",
-        "additionalShopIds": [],
-        "question": question,
-        "query": question,
-        "generateInsights": True,
-        "isOutsideMainChat": True
-    }
-    
-    # Add any additional parameters
-    if additional_params:
-        payload.update(additional_params)
-
-    full_endpoint = f"{MOBY_TLD}{endpoint}"
-    response = requests.post(
-        full_endpoint,
-        headers=headers,
-        json=payload
-    )
-
-    if response.status_code == 200 and response.text.strip():
-        try:
-            return response.json()
-        except json.JSONDecodeError as json_err:
-            log(f"JSON parsing error: {json_err}", "ERROR")
-            raise Exception(f"Could not parse API response: {str(json_err)}")
-    else:
-        error_msg = f"API request failed with status {response.status_code}"
-        log(error_msg, "ERROR")
-        raise Exception(error_msg)
+
+    # Repeated (endpoint, shop, question) calls within the TTL window skip
+    # the backend round trip entirely; extra params join the key so variants
+    # don't collide
+    cache_key = None
+    if cache:
+        extra = repr(sorted(additional_params.items())) if additional_params else ''
+        cache_key = tool_cache_key(f"moby:{endpoint}|{extra}", shop_id, question)
+        cached = get_cached_tool_result(cache_key)
+        if cached is not None:
+            return cached
+
+    async def _do_request() -> Dict[str, Any]:
+        # Generate a UUID for conversation if not provided
+        conv_id = conversation_id if conversation_id else fast_id()
+
+        # Constant fields come from the shared base; only the per-call keys
+        # are built here
+        payload = {
+            **_BASE_MOBY_PAYLOAD,
+            "shopId": shop_id,
+            "conversationId": conv_id,
+            "question": question,
+            "query": question
+        }
+
+        # Add any additional parameters
+        if additional_params:
+            payload.update(additional_params)
+
+        full_endpoint = f"{MOBY_TLD}{endpoint}"
+        response = await guarded_post(
+            full_endpoint,
+            headers=JSON_HEADERS,
+            json=payload
+        )
+
+        if response.status_code == 200 and response.content and not response.content.isspace():
+            try:
+                data = loads(response.content)
+                if cache_key is not None:
+                    cache_tool_result(cache_key, data)
+                return data
+            except ValueError as json_err:
+                log(f"JSON parsing error: {json_err}", "ERROR")
+                raise Exception(f"Could not parse API response: {str(json_err)}")
+        else:
+            error_msg = f"API request failed with status {response.status_code}"
+            log(error_msg, "ERROR")
+            raise Exception(error_msg)
+
+    if cache_key is None:
+        return await _do_request()
+
+    # Concurrent identical calls share one in-flight request
+    return await singleflight(cache_key, _do_request)
 
 # Helper function to add tool completion notifications to all tools
 async def send_tool_completion_notification(wrapper, tool_name):
@@ -219,7 +507,9 @@ async def send_tool_completion_notification(wrapper, tool_name):
     """
     try:
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, tool_name, "completed")
+        # Fire-and-forget, like the starting notifications: the tool's return
+        # value shouldn't wait on an advisory emit
+        fire_notification(context, tool_name, "completed")
     except Exception as e:
         log(f"Error sending completion notification for {tool_name}: {str(e)}", "ERROR")
         pass  # Don't throw errors from notification functions 
\ No newline at end of file
@@ -1,12 +1,9 @@
 """
 Vision tool for Triple Whale - analyzes images and videos.
 """
-import uuid
-import json
-import requests
 from agents import function_tool, RunContextWrapper
 from typing import Optional, List
-from .utils import log, send_tool_notification, send_tool_completion_notification, MOBY_TLD
+from .utils import fast_id, log, JSON_HEADERS, fire_notification, send_tool_completion_notification, MOBY_TLD, guarded_post, dumps, loads
 
 # Vision endpoint
 VISION_ENDPOINT = f"{MOBY_TLD}/api/vision"
@@ -28,12 +25,12 @@ async def vision(
         Analysis and description of the visual content
     """
     try:
-        # Generate a unique message ID
-        message_id = str(uuid.uuid4())
+        # Generate a unique message ID (.hex skips the hyphenated str format)
+        message_id = fast_id()
         
         # Send tool notification
         context = getattr(wrapper, 'context', {})
-        await send_tool_notification(context, "vision", "starting")
+        fire_notification(context, "vision")
         
         log(f"Vision tool called with question: '{question}'", "INFO")
         
@@ -47,11 +44,7 @@ async def vision(
         # Get uploaded files from context if available
         uploaded_files = context.get('uploaded_files', [])
         
-        # Prepare headers and payload for the API call
-        headers = {
-            'content-type': 'application/json'
-        }
-        
+        # Prepare the payload for the API call (headers are the shared constant)
         payload = {
             "question": question,
             "originalQuestion": original_question,
@@ -62,20 +55,20 @@ async def vision(
             "userId": "test-user"
         }
         
-        # Make the direct API call
-        response = requests.post(
+        # Make the API call on the shared async client
+        response = await guarded_post(
             VISION_ENDPOINT,
-            headers=headers,
+            headers=JSON_HEADERS,
             json=payload
         )
         
-        if response.status_code == 200 and response.text.strip():
+        if response.status_code == 200 and response.content and not response.content.isspace():
             try:
-                data = response.json()
+                data = loads(response.content)
                 # Return the formatted response
                 await send_tool_completion_notification(wrapper, "vision")
-                return json.dumps(data)
-            except json.JSONDecodeError as json_err:
+                return dumps(data)
+            except ValueError as json_err:
                 log(f"JSON parsing error: {json_err}", "ERROR")
                 await send_tool_completion_notification(wrapper, "vision")
                 return f"Error: Could not parse API response. {str(json_err)}"
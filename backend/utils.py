@@ -1,52 +1,113 @@
 """
 Utility functions for the Triple Whale agent system.
 """
+import hashlib
+import logging
+import logging.handlers
+import queue
 import sys
+import time
 import uuid
 import json
 import os
+from collections import OrderedDict
 from datetime import datetime
 from typing import Any, Dict, Optional
 
+# orjson encodes typical nested dicts several times faster than stdlib json;
+# fall back transparently when it isn't installed.
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj)
+
 # Global log level - can be DEBUG, INFO, WARNING, ERROR
 # Default to INFO, but can be overridden by environment variable
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
 
+# Logging is queued: log() only enqueues the formatted line and a single
+# listener thread does the stream writes, so a slow or blocked stdout (e.g.
+# a container without a TTY) can never stall the event loop.
+_LOG_QUEUE = queue.SimpleQueue()
+_LOG_HANDLER = logging.StreamHandler(sys.stdout)
+_LOG_HANDLER.setFormatter(logging.Formatter('%(message)s'))
+_LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE, _LOG_HANDLER)
+_LOG_LISTENER.start()
+
+_logger = logging.getLogger('triplewhale')
+_logger.setLevel(logging.DEBUG)
+_logger.propagate = False
+_logger.addHandler(logging.handlers.QueueHandler(_LOG_QUEUE))
+
+# Log level priorities (higher number = more important). The threshold is
+# resolved once at import so suppressed calls cost a single dict lookup and
+# compare, with no string allocation.
+_LOG_PRIORITIES = {
+    'DEBUG': 0,
+    'INFO': 1,
+    'WARNING': 2,
+    'ERROR': 3,
+    'GLOBAL': 4
+}
+_LOG_THRESHOLD = _LOG_PRIORITIES.get(LOG_LEVEL, 1)
+
 def log(message, level='INFO'):
-    """Print a message to stdout and flush the buffer immediately, respecting log level."""
-    # Convert level to uppercase for comparison
-    level = level.upper()
-    
-    # Define log level priorities (higher number = more important)
-    log_priorities = {
-        'DEBUG': 0,
-        'INFO': 1,
-        'WARNING': 2,
-        'ERROR': 3,
-        'GLOBAL': 4
-    }
-    
-    # Only print if the message's level is at least as important as the global log level
-    if log_priorities.get(level, 0) >= log_priorities.get(LOG_LEVEL, 1):
+    """Queue a message for logging, respecting log level. Never blocks on I/O."""
+    # Callers pass uppercase levels; only normalize when the fast lookup misses
+    priority = _LOG_PRIORITIES.get(level)
+    if priority is None:
+        level = level.upper()
+        priority = _LOG_PRIORITIES.get(level, 0)
+
+    # Only log if the message's level is at least as important as the global log level
+    if priority >= _LOG_THRESHOLD:
         # Format with level if not INFO (default)
         if level != 'INFO':
-            print(f"[{level}] {message}")
+            _logger.info(f"[{level}] {message}")
         else:
-            print(message)
-        sys.stdout.flush()
+            _logger.info(message)
+
+# Memoization for format_agent_response. Retry and identical-prompt flows
+# hand the same (often large) final_output back repeatedly; keying on a
+# digest of its repr lets those skip the model_dump/json.dumps work.
+_FMT_CACHE_MAX_ENTRIES = 1024
+_fmt_cache: "OrderedDict[bytes, str]" = OrderedDict()
 
 def format_agent_response(output):
     """Format the agent's response in a consistent way."""
     # Handle None case
     if output is None:
         return "I don't have a specific response for that query."
-        
-    # Check if output is a Pydantic model and convert to dict
-    if hasattr(output, "model_dump"):
-        output = output.model_dump()
-    elif hasattr(output, "dict"):  # Support for older pydantic versions
-        output = output.dict()
-    
+
+    cache_key = hashlib.blake2b(repr(output).encode('utf-8'), digest_size=16).digest()
+    cached = _fmt_cache.get(cache_key)
+    if cached is not None:
+        _fmt_cache.move_to_end(cache_key)
+        return cached
+
+    formatted = _format_agent_response_uncached(output)
+    _fmt_cache[cache_key] = formatted
+    while len(_fmt_cache) > _FMT_CACHE_MAX_ENTRIES:
+        _fmt_cache.popitem(last=False)
+    return formatted
+
+def _format_agent_response_uncached(output):
+    # Exact-type fast paths first: plain str and dict cover nearly every
+    # response and skip the attribute probing below
+    if type(output) is str:
+        return output
+
+    if type(output) is not dict:
+        # Pydantic models: model_dump on v2, dict on v1. getattr with a
+        # default avoids hasattr's try/except when neither attribute exists.
+        dump = getattr(output, "model_dump", None) or getattr(output, "dict", None)
+        if dump is not None:
+            output = dump()
+
     # Handle dictionary output
     if isinstance(output, dict):
         if "message" in output:
@@ -56,11 +117,37 @@ def format_agent_response(output):
         elif "content" in output:
             return output["content"]
         # Return JSON string if no specific fields found
-        return json.dumps(output)
+        return _json_dumps(output)
     
     # Default: return as string
     return str(output)
     
+# Formatted timestamps are cached and refreshed on demand so bursts of
+# history appends don't each pay for a syscall + strftime. Chat timestamps
+# are minute-precision, so a 1s window loses nothing; the ISO variant keeps
+# a much smaller window.
+_TIMESTAMP_CACHE_WINDOW = 1.0
+_ISO_CACHE_WINDOW = 0.001
+
+_cached_timestamp = ""
+_cached_timestamp_at = float('-inf')
+_cached_iso = ""
+_cached_iso_at = float('-inf')
+
 def get_timestamp():
     """Get current timestamp in a consistent format."""
-    return datetime.now().strftime("%I:%M %p") 
\ No newline at end of file
+    global _cached_timestamp, _cached_timestamp_at
+    now = time.monotonic()
+    if now - _cached_timestamp_at >= _TIMESTAMP_CACHE_WINDOW:
+        _cached_timestamp = datetime.now().strftime("%I:%M %p")
+        _cached_timestamp_at = now
+    return _cached_timestamp
+
+def get_iso_timestamp():
+    """Get the current ISO-format timestamp (cached per millisecond)."""
+    global _cached_iso, _cached_iso_at
+    now = time.monotonic()
+    if now - _cached_iso_at >= _ISO_CACHE_WINDOW:
+        _cached_iso = datetime.now().isoformat()
+        _cached_iso_at = now
+    return _cached_iso 
\ No newline at end of file
@@ -5,26 +5,37 @@ This will replace direct 'completed' status notifications with the helper functi
 """
 import os
 import re
-import glob
 
 # Root directory for tools
 TOOLS_DIR = "backend/tools"
 
+# Patterns are compiled once here instead of per file
+_TOOL_NAME_PATTERN = re.compile(r'await send_tool_notification\(context, "([^"]+)"')
+_CONTEXT_AND_COMPLETED_PATTERN = re.compile(
+    r'context = getattr\(wrapper, \'context\', {}\)\s+await send_tool_notification\(context, "([^"]+)", "completed"\)'
+)
+_COMPLETED_PATTERN = re.compile(
+    r'await send_tool_notification\(context, "([^"]+)", "completed"\)'
+)
+
 def cleanup_tool_file(filepath):
     """Update a single tool file to use the new completion helper."""
-    with open(filepath, 'r') as f:
-        content = f.read()
-    
+    # Read bytes and bail before decoding: most files are already migrated,
+    # so the common case never pays for a UTF-8 decode
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+
     # Skip if it doesn't have any completed status calls
-    if 'status="completed"' not in content and "status='completed'" not in content:
+    if b'status="completed"' not in raw and b"status='completed'" not in raw:
         print(f"Skipping {filepath} - no cleanup needed")
         return
+
+    content = raw.decode('utf-8')
     
     print(f"Cleaning up {filepath}")
     
     # Find tool names in the file from various patterns
-    tool_pattern = re.compile(r'await send_tool_notification\(context, "([^"]+)"')
-    tool_names = tool_pattern.findall(content)
+    tool_names = _TOOL_NAME_PATTERN.findall(content)
     
     if not tool_names:
         print(f"  Warning: Could not find tool name in {filepath}")
@@ -42,16 +53,14 @@ def cleanup_tool_file(filepath):
             )
     
     # Pattern 1: Replace context extraction + completed notification
-    content = re.sub(
-        r'context = getattr\(wrapper, \'context\', {}\)\s+await send_tool_notification\(context, "([^"]+)", "completed"\)', 
-        r'await send_tool_completion_notification(wrapper, "\1")', 
+    content = _CONTEXT_AND_COMPLETED_PATTERN.sub(
+        r'await send_tool_completion_notification(wrapper, "\1")',
         content
     )
     
     # Pattern 2: Replace direct completed notifications
-    content = re.sub(
-        r'await send_tool_notification\(context, "([^"]+)", "completed"\)', 
-        r'await send_tool_completion_notification(wrapper, "\1")', 
+    content = _COMPLETED_PATTERN.sub(
+        r'await send_tool_completion_notification(wrapper, "\1")',
         content
     )
     
@@ -65,11 +74,13 @@ def main():
     """Main function to cleanup tool files."""
     print("Cleaning up tool notification patterns in all tool files...")
     
-    # Find all Python files in the tools directory
-    tool_files = glob.glob(f"{TOOLS_DIR}/*.py")
-    
-    # Skip the utils file
-    tool_files = [f for f in tool_files if not f.endswith('utils.py')]
+    # Find all Python files in the tools directory except the utils module;
+    # scandir filters in one directory pass with one stat per entry
+    with os.scandir(TOOLS_DIR) as entries:
+        tool_files = [
+            entry.path for entry in entries
+            if entry.is_file() and entry.name.endswith('.py') and entry.name != 'utils.py'
+        ]
     
     # Update each file
     updated_count = 0
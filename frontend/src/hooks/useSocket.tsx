@@ -38,8 +38,15 @@ export const useSocket = ({
 
     socketManager.addConnectionListener(connectionListener);
 
+    // The server batches bursts of tool notifications into a single frame;
+    // unpack them through the regular stream update handler
+    const onStreamUpdateBatch = (batch: { events?: any[] }) => {
+      batch.events?.forEach(onStreamUpdate);
+    };
+
     // Set up event handlers
     socket.on('stream_update', onStreamUpdate);
+    socket.on('stream_update_batch', onStreamUpdateBatch);
     socket.on('stream_cancelled', onStreamCancelled);
     socket.on('chat_history', onChatHistory);
     socket.on('history_cleared', onHistoryCleared);
@@ -55,6 +62,7 @@ export const useSocket = ({
     return () => {
       // Remove all event listeners
       socket.off('stream_update', onStreamUpdate);
+      socket.off('stream_update_batch', onStreamUpdateBatch);
       socket.off('stream_cancelled', onStreamCancelled);
       socket.off('chat_history', onChatHistory);
       socket.off('history_cleared', onHistoryCleared);